@@ -18,6 +18,7 @@ from .py.resolutions import DraekzResolutions
 from .py.resolution_multiply import DraekzResolutionMultiply
 from .py.resolution_by_ratio import DraekzResolutionsByRatio
 from .py.llm_prompt import DraekzLLMPrompt
+from .py.llm_prompt_batch import DraekzLLMPromptBatch
 from .py.llm_options import DraekzLLMOptions
 
 NODE_CLASS_MAPPINGS = {
@@ -28,6 +29,7 @@ NODE_CLASS_MAPPINGS = {
     DraekzResolutionMultiply.NAME: DraekzResolutionMultiply,
     DraekzResolutionsByRatio.NAME: DraekzResolutionsByRatio,
     DraekzLLMPrompt.NAME: DraekzLLMPrompt,
+    DraekzLLMPromptBatch.NAME: DraekzLLMPromptBatch,
     DraekzLLMOptions.NAME: DraekzLLMOptions,
 }
 
@@ -174,13 +174,36 @@ class JoyCaptionPredictor:
             self.model = LlavaForConditionalGeneration.from_pretrained(str(checkpoint_path), torch_dtype="auto",
                                                                        device_map="auto",
                                                                        quantization_config=qnt_config)
+        # Batched prompts are left padded, so generated tokens line up at the end of every row.
+        self.processor.tokenizer.padding_side = "left"
+        if self.processor.tokenizer.pad_token is None:
+            self.processor.tokenizer.pad_token = self.processor.tokenizer.eos_token
         print(f"Loaded model {model} with memory mode {memory_mode}")
         # print(self.model)
         self.model.eval()
 
-    @torch.inference_mode()
     def generate(self, image: Image.Image, system: str, prompt: str, max_new_tokens: int, temperature: float,
                  top_p: float, top_k: int) -> str:
+        return self.generate_batch([image], system, prompt, max_new_tokens, temperature, top_p, top_k)[0]
+
+    def get_auto_batch_size(self, prompt_tokens: int, max_new_tokens: int) -> int:
+        """Estimates how many images fit in one batch from free GPU memory and the KV cache size per image."""
+        if not torch.cuda.is_available():
+            return 1
+        free_bytes, _total = torch.cuda.mem_get_info()
+        text_config = getattr(self.model.config, "text_config", self.model.config)
+        num_heads = text_config.num_attention_heads
+        head_dim = getattr(text_config, "head_dim", None) or text_config.hidden_size // num_heads
+        kv_dim = getattr(text_config, "num_key_value_heads", None) or num_heads
+        kv_bytes_per_token = 2 * text_config.num_hidden_layers * kv_dim * head_dim * 2  # keys & values, bf16
+        # Activations, logits and the vision tower add to the KV cache, so leave plenty of headroom.
+        per_image = kv_bytes_per_token * (prompt_tokens + max_new_tokens) * 3
+        return max(1, int(free_bytes * 0.8) // per_image)
+
+    @torch.inference_mode()
+    def generate_batch(self, images: list, system: str, prompt: str, max_new_tokens: int, temperature: float,
+                       top_p: float, top_k: int, batch_size: int = 0) -> list:
+        """Captions many images, in left-padded micro-batches of `batch_size` (0 to size them to free memory)."""
         convo = [
             {
                 "role": "system",
@@ -196,29 +219,51 @@ class JoyCaptionPredictor:
         convo_string = self.processor.apply_chat_template(convo, tokenize=False, add_generation_prompt=True)
         assert isinstance(convo_string, str)
 
-        # Process the inputs
-        inputs = self.processor(text=[convo_string], images=[image], return_tensors="pt").to('cuda')
-        inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
+        captions = []
+        index = 0
+        while index < len(images):
+            batch = images[index:index + batch_size] if batch_size > 0 else images[index:index + 1]
+            # Process the inputs. Prompts are left padded so every row's generation starts at the same position.
+            inputs = self.processor(text=[convo_string] * len(batch), images=batch, return_tensors="pt",
+                                    padding=True).to('cuda')
+            inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
+
+            if batch_size <= 0:
+                # Caption the first image on its own, then size the micro-batches now that we know the prompt's
+                # length.
+                batch_size = self.get_auto_batch_size(inputs['input_ids'].shape[1], max_new_tokens)
+                print(f"JoyCaption: captioning {len(images)} images in batches of {batch_size}")
 
-        # Generate the captions
-        generate_ids = self.model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            do_sample=True if temperature > 0 else False,
-            suppress_tokens=None,
-            use_cache=True,
-            temperature=temperature,
-            top_k=None if top_k == 0 else top_k,
-            top_p=top_p,
-        )[0]
+            try:
+                # Generate the captions
+                generate_ids = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=True if temperature > 0 else False,
+                    suppress_tokens=None,
+                    use_cache=True,
+                    temperature=temperature,
+                    top_k=None if top_k == 0 else top_k,
+                    top_p=top_p,
+                )
+            except torch.cuda.OutOfMemoryError:
+                if len(batch) == 1:
+                    raise
+                del inputs
+                torch.cuda.empty_cache()
+                batch_size = max(1, len(batch) // 2)
+                print(f"JoyCaption: out of memory, retrying in batches of {batch_size}")
+                continue
 
-        # Trim off the prompt
-        generate_ids = generate_ids[inputs['input_ids'].shape[1]:]
+            # Trim off the prompt
+            generate_ids = generate_ids[:, inputs['input_ids'].shape[1]:]
 
-        # Decode the caption
-        caption = self.processor.tokenizer.decode(generate_ids, skip_special_tokens=True,
-                                                  clean_up_tokenization_spaces=False)
-        return caption.strip()
+            # Decode the captions
+            batch_captions = self.processor.tokenizer.batch_decode(generate_ids, skip_special_tokens=True,
+                                                                   clean_up_tokenization_spaces=False)
+            captions.extend(caption.strip() for caption in batch_captions)
+            index += len(batch)
+        return captions
 
 class Draekz_JoyCaption:
     @classmethod
@@ -247,10 +292,17 @@ class Draekz_JoyCaption:
             "top_k": ("INT", {"default": 0, "min": 0, "max": 100}),
         }
 
-        return {"required": req}
+        opt = {
+            # 0 sizes the batches to the free GPU memory.
+            "batch_size": ("INT", {"default": 0, "min": 0, "max": 256}),
+        }
+
+        return {"required": req, "optional": opt}
 
     RETURN_TYPES = ("STRING", "STRING")
     RETURN_NAMES = ("query", "caption")
+    # One caption per image in the batch.
+    OUTPUT_IS_LIST = (False, True)
     FUNCTION = "generate"
     CATEGORY = "JoyCaption"
 
@@ -259,7 +311,7 @@ class Draekz_JoyCaption:
         self.current_memory_mode = None
 
     def generate(self, image, memory_mode, caption_type, caption_length, extra_option1, extra_option2, extra_option3,
-                 extra_option4, extra_option5, extra_option6, extra_option7, extra_option8, person_name, max_new_tokens, temperature, top_p, top_k):
+                 extra_option4, extra_option5, extra_option6, extra_option7, extra_option8, person_name, max_new_tokens, temperature, top_p, top_k, batch_size=0):
         # Check if the requested model is already in our global cache
         predictor = JOY_CAPTION_MODELS.get(memory_mode)
 
@@ -280,7 +332,7 @@ class Draekz_JoyCaption:
                 JOY_CAPTION_MODELS[memory_mode] = predictor
             except Exception as e:
                 # Return the error message if loading fails
-                return (f"Error loading model: {e}", f"Error loading model: {e}")
+                return (f"Error loading model: {e}", [f"Error loading model: {e}"])
 
         extras = [extra_option1, extra_option2, extra_option3, extra_option4, extra_option5, extra_option6, extra_option7, extra_option8]
         extras = [extra for extra in extras if extra]
@@ -290,18 +342,19 @@ class Draekz_JoyCaption:
         # This is a bit silly. We get the image as a tensor, and we could just use that directly (just need to resize and adjust the normalization).
         # But JoyCaption was trained on images that were resized using lanczos, which I think PyTorch doesn't support.
         # Just to be safe, we'll convert the image to a PIL image and let the processor handle it correctly.
-        pil_image = ToPILImage()(image[0].permute(2, 0, 1))
-        response = predictor.generate(
-            image=pil_image,
+        pil_images = [ToPILImage()(img.permute(2, 0, 1)) for img in image]
+        captions = predictor.generate_batch(
+            images=pil_images,
             system=system_prompt,
             prompt=prompt,
             max_new_tokens=max_new_tokens,
             temperature=temperature,
             top_p=top_p,
             top_k=top_k,
+            batch_size=batch_size,
         )
 
-        return (prompt, response)
+        return (prompt, captions)
 
 class Draekz_Resolution_Multiply:
     """
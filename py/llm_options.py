@@ -20,6 +20,25 @@ class DraekzLLMOptions:
                 "top_p": ("FLOAT", {"default": 0.9, "min": 0.1, "step": 0.05}),
                 "top_k": ("INT", {"default": 50, "min": 0}),
                 "repetition_penalty": ("FLOAT", {"default": 1.2, "min": 0.1, "step": 0.05}),
+            },
+            # Load time options. Changing these reloads the model, the sampling options above don't.
+            "optional": {
+                "n_ctx": ("INT", {"default": 2048, "min": 512, "max": 131072, "step": 256,
+                                  "tooltip": "Context window size, in tokens."}),
+                "n_gpu_layers": ("INT", {"default": -1, "min": -1, "max": 1000,
+                                         "tooltip": "Layers to offload to the GPU; -1 for all."}),
+                "n_threads": ("INT", {"default": 0, "min": -1, "max": 1024,
+                                      "tooltip": "CPU threads; 0 for llama.cpp's default (half the cores), -1 for all cores."}),
+                "n_batch": ("INT", {"default": 512, "min": 1, "max": 8192,
+                                    "tooltip": "Tokens evaluated per batch while processing the prompt."}),
+                "use_mmap": ("BOOLEAN", {"default": True}),
+                "use_mlock": ("BOOLEAN", {"default": False,
+                                          "tooltip": "Lock the model in RAM so it's never swapped out."}),
+                "flash_attn": ("BOOLEAN", {"default": False}),
+                "json_grammar": ("BOOLEAN", {"default": False,
+                                             "tooltip": "Constrain output to a JSON object with CLIP_L and T5XXL strings."}),
+                "stop_at_json_end": ("BOOLEAN", {"default": True,
+                                                 "tooltip": "Stop generating once a JSON object response closes."}),
             }
         }
 
@@ -27,11 +46,22 @@ class DraekzLLMOptions:
     RETURN_TYPES = ("DRAEKZLLMCONFIG",)
     RETURN_NAMES = ("options_config",)
 
-    def main(self, temperature=1.0, top_p=0.9, top_k=50, repetition_penalty=1.2):
+    def main(self, temperature=1.0, top_p=0.9, top_k=50, repetition_penalty=1.2, n_ctx=2048,
+             n_gpu_layers=-1, n_threads=0, n_batch=512, use_mmap=True, use_mlock=False,
+             flash_attn=False, json_grammar=False, stop_at_json_end=True):
         options_config = {
             "temperature": temperature,
             "top_p": top_p,
             "top_k": top_k,
             "repeat_penalty": repetition_penalty,
+            "n_ctx": n_ctx,
+            "n_gpu_layers": n_gpu_layers,
+            "n_threads": n_threads,
+            "n_batch": n_batch,
+            "use_mmap": use_mmap,
+            "use_mlock": use_mlock,
+            "flash_attn": flash_attn,
+            "json_grammar": json_grammar,
+            "stop_at_json_end": stop_at_json_end,
         }
         return (options_config,)
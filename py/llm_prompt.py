@@ -1,52 +1,302 @@
 import importlib
 import os
-import folder_paths
+import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+
+import comfy.model_management
 
 # All nodes started from code provided thanks to SeargeDP
 # See license details in the main LICENSE.searge_llm file
 # https://github.com/SeargeDP/ComfyUI_Searge_LLM
 
 from .constants import get_category, get_name
+from .config import get_config_value
+from .utils_llm import get_gguf_models, get_llm_cache, get_model_path, get_response_cache, touch_model_file
+from .utils_llm import enable_prompt_cache, get_prompt_cache_bytes, prime_prompt_cache
+from .utils_llm import stream_chat_completion
+from .utils_llm import get_worker_pool
 
 NODE_NAME = get_name('LLM Prompt')
 
-GLOBAL_MODELS_DIR = os.path.join(folder_paths.models_dir, "llm_gguf")
-
 DEFAULT_INSTRUCTIONS = 'You are an expert prompt engineer for the FLUX text-to-image model, which uses two text encoders: CLIP-L and T5-XXL. Your task is to take a users simple prompt and rewrite it into an optimized JSON object that leverages the unique strengths of each encoder.  ## Instructions:  1.  **For the `"CLIP_L"` property:** This prompt should focus on the **core subjects, objects, visual style, and overall composition**. It works best with descriptive keywords and phrases, separated by commas. Focus on *what* to see. 2.  **For the `"T5XXL"` property:** This prompt must be a **detailed, grammatically correct sentence** that describes the scene in a more narrative way. It excels at understanding complex relationships between objects, specific actions, and intricate details. Focus on *how* everything comes together in the scene.  ## Example:  **User Prompt:** `a knight fighting a dragon`  **Your Output:** {   "CLIP_L": "epic fantasy painting, a knight in shining armor, a fearsome red dragon, castle in the background, dramatic lighting, highly detailed, cinematic",   "T5XXL": "A cinematic, highly detailed fantasy painting of a knight in shining armor bravely fighting a fearsome red dragon in front of a distant castle under a dramatically lit sky." }  ## Constraints:  - Your final response must **only** be the raw JSON object. - Do not include any explanations, markdown formatting, or any other text.  ---  Now, process the following prompt: "{prompt}"'
 
+# The system prompt and few-shot conversation sent before the user request when instructions are
+# applied. This prefix is the same for every request, so its evaluation is reused between calls.
+FEW_SHOT_MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user",
+     "content": "An image generation prompt is a single paragraph summary to describe the subject and style of an image. It includes a description of the kind of image, the subject of the image, and some description of the image medium and style in the form of short keyword.\n\nCreate an image generation prompt for the subject \"a creepy creature shadow in the dark in a dimly lit tunnel\" in the style \"digital art illustration with intricate details\"."},
+    {"role": "assistant",
+     "content": "Image Description: A digitally crafted illustration portrays a chilling scene within a dimly lit, cavernous tunnel. The dominant subject of the image is a mysterious creature, its form subtly discernible only as a menacing shadow on the walls of the tunnel. Its elongated silhouette suggests a serpentine creature with sharp protrusions and an ominous aura. The creature's eyes, a pair of glowing orbs, appear eerily human-like yet alien. The tunnel is riddled with intricate details that enhance the eerie atmosphere: dust particles floating lazily in the feeble light, ancient and crumbling stone, water droplets sparkling on the damp walls, and a hauntingly beautiful, bioluminescent fungi growing in the shadows. The dimly lit environment is highlighted by strategically placed light sources that create dramatic chiaroscuro effects, casting an unsettling and atmospheric glow on the scene. Digital Art Illustration with Intricate Details (Dark, Atmospheric, Suspenseful)"},
+    {"role": "user", "content": "Now compile the description and style into a single paragraph summary"},
+    {"role": "assistant",
+     "content": "Digital art illustration featuring a dark, atmospheric, and suspenseful scene within a dimly lit, cavernous tunnel. The subject of the image is a mysterious creature, depicted only as a menacing shadow on the walls, with elongated silhouette and sharp protrusions. The creature's eyes, a pair of glowing orbs, appear eerily human-like yet alien. The tunnel is adorned with intricate details, such as dust particles, ancient crumbling stone, water droplets, and a hauntingly beautiful bioluminescent fungi growing in the shadows. Dramatic chiaroscuro effects are created through strategically placed light sources, casting an unsettling and atmospheric glow on the scene."},
+    {"role": "user", "content": "create a detailed summary without the title or style"},
+    {"role": "assistant",
+     "content": "A dimly lit, cavernous tunnel is the setting for this chilling digital illustration. A mysterious creature lurks in the shadows, its elongated silhouette suggestive of a serpentine creature with sharp protrusions and an ominous aura. The creature's eyes, a pair of glowing orbs, appear eerily human-like yet alien. The tunnel is riddled with intricate details that enhance the eerie atmosphere: dust particles floating lazily in the feeble light, ancient and crumbling stone, water droplets sparkling on the damp walls, and a hauntingly beautiful, bioluminescent fungi growing in the shadows. Dramatic chiaroscuro effects are created through strategically placed light sources, casting an unsettling and atmospheric glow on the scene."},
+    {"role": "user",
+     "content": "Generate a prompt from \"magical garden, sitting on a blue_bench, Disney Princess in pink_dress, blonde_hair, portrait, Pixar, Disney style, photorealistic, high details, detailed skin, pores, freckles\""},
+    {"role": "assistant",
+     "content": "In a captivating, Pixar-inspired, Disney-style, photorealistic portrait, a magical garden unfolds as a breathtaking backdrop. The subject of the image is a Disney Princess, dressed elegantly in a pink gown with flowing fabric, sitting serenely on a blue bench. The princess boasts long, blonde hair and a radiant smile. The garden is meticulously detailed, with vibrant, enchanted flora and fauna, as well as whimsical details like sparkling fairy lights and a picturesque waterfall. The princess is highlighted against the lush, detailed foliage, with a focus on the high-definition details of her porcelain skin, visible freckles, and the intricacies of her elegant gown. The image is rendered in the captivating, photorealistic style that exemplifies both the Disney and Pixar brands, capturing the princess's timeless beauty and the magic of her enchanting surroundings."},
+]
+
+# A llama.cpp GBNF grammar for the object DEFAULT_INSTRUCTIONS asks for, so a constrained generation
+# is always a single valid JSON object with CLIP_L and T5XXL strings, and ends as the object closes.
+FLUX_JSON_GRAMMAR = r'''
+root ::= "{" ws "\"CLIP_L\"" ws ":" ws string ws "," ws "\"T5XXL\"" ws ":" ws string ws "}"
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" hex hex hex hex ) )* "\""
+hex ::= [0-9a-fA-F]
+ws ::= | " " | "\n" [ \t]{0,20}
+'''
+
 # Dynamically import either the CUDA or the standard version of llama_cpp
 try:
-    Llama = importlib.import_module("llama_cpp_cuda").Llama
+    llama_cpp = importlib.import_module("llama_cpp_cuda")
     print("Draekz LLM: llama_cpp_cuda loaded.")
 except ImportError:
-    Llama = importlib.import_module("llama_cpp").Llama
+    llama_cpp = importlib.import_module("llama_cpp")
     print("Draekz LLM: llama_cpp loaded.")
+Llama = llama_cpp.Llama
+
+# Options applied when a model is loaded; changing any of these reloads the model.
+DEFAULT_LOAD_OPTIONS = {
+    'n_ctx': 2048,  # Context window size
+    'n_gpu_layers': -1,  # Offload all possible layers to GPU
+    'n_threads': 0,  # 0 for llama.cpp's default, -1 for all cores
+    'n_batch': 512,
+    'use_mmap': True,
+    'use_mlock': False,
+    'flash_attn': False,
+}
+
+
+def get_load_options(options_config=None):
+    """Returns the load time options, from the options config where provided."""
+    load_options = dict(DEFAULT_LOAD_OPTIONS)
+    if options_config:
+        for option in DEFAULT_LOAD_OPTIONS:
+            if option in options_config:
+                load_options[option] = options_config[option]
+    return load_options
+
+
+def get_llama_kwargs(load_options):
+    """Returns the Llama constructor arguments for load options."""
+    n_threads = load_options['n_threads']
+    return {
+        **load_options,
+        'n_threads': (os.cpu_count() if n_threads == -1 else n_threads) or None,
+    }
+
+
+def load_model(model, load_options):
+    """Loads a GGUF model, with a prompt cache primed with the few-shot conversation."""
+    llm = Llama(
+        model_path=get_model_path(model),
+        verbose=False,  # Suppress verbose output from llama.cpp
+        **get_llama_kwargs(load_options),
+    )
+    enable_prompt_cache(llm, getattr(llama_cpp, "LlamaRAMCache", None))
+    if get_config_value('llm.prime_few_shot') is True:
+        prime_prompt_cache(llm, FEW_SHOT_MESSAGES)
+    return llm
+
+
+def get_model_options():
+    """Returns the GGUF models in the llm_gguf folder."""
+    return get_gguf_models()
+
+
+def warm_up_models():
+    """Loads, or reads into the OS cache, the models in `llm.warmup_models` on a background thread.
+
+    Entries are model file names, or `{"model": name, "options": {...}}` to load with the same load
+    options an LLM Options node would give.
+    """
+    entries = get_config_value('llm.warmup_models') or []
+    if not entries:
+        return
+    # Worker processes load their own models, so here we can only warm up the files for them.
+    touch_only = get_config_value('llm.warmup_mode') == 'touch' or get_worker_pool() is not None
+
+    def run():
+        for entry in entries:
+            model = entry if isinstance(entry, str) else entry.get('model')
+            options_config = None if isinstance(entry, str) else entry.get('options')
+            if not model or model not in get_gguf_models():
+                print(f"Draekz LLM: Warm up model '{model}' not found.")
+                continue
+            try:
+                if touch_only:
+                    touch_model_file(model)
+                    print(f"Draekz LLM: Warmed up model file '{model}'.")
+                else:
+                    load_options = get_load_options(options_config)
+                    get_llm_cache().load(
+                        model, lambda: load_model(model, load_options), load_params=load_options
+                    )
+            except Exception as e:  # pylint: disable = broad-exception-caught
+                print(f"Draekz LLM: Could not warm up model '{model}': {e}")
+
+    threading.Thread(target=run, name='draekz_llm_warmup', daemon=True).start()
+
+
+def get_messages(text, apply_instructions, instructions):
+    """Returns the chat messages for a request."""
+    if apply_instructions:
+        req = instructions.replace("{prompt}", text) if "{prompt}" in instructions else f"{instructions} {text}"
+        messages = [
+            *FEW_SHOT_MESSAGES,
+            {"role": "user", "content": req},
+        ]
+    else:
+        messages = [
+            {"role": "system",
+             "content": "You are a helpful assistant. Try your best to give the best response possible to the user."},
+            {"role": "user",
+             "content": f"Create a detailed visually descriptive caption of this description, which will be used as a prompt for a text to image AI system (caption only, no instructions like \"create an image\").Remove any mention of digital artwork or artwork style. Give detailed visual descriptions of the character(s), including ethnicity, skin tone, expression etc. Imagine using keywords for a still for someone who has aphantasia. Describe the image style, e.g. any photographic or art styles / techniques utilized. Make sure to fully describe all aspects of the cinematography, with abundant technical details and visual descriptions. If there is more than one image, combine the elements and characters from all of the images creatively into a single cohesive composition with a single background, inventing an interaction between the characters. Be creative in combining the characters into a single cohesive scene. Focus on two primary characters (or one) and describe an interesting interaction between them, such as a hug, a kiss, a fight, giving an object, an emotional reaction / interaction. If there is more than one background in the images, pick the most appropriate one. Your output is only the caption itself, no comments or extra formatting. The caption is in a single long paragraph. If you feel the images are inappropriate, invent a new scene / characters inspired by these. Additionally, incorporate a specific movie director's visual style and describe the lighting setup in detail, including the type, color, and placement of light sources to create the desired mood and atmosphere. Always frame the scene, including details about the film grain, color grading, and any artifacts or characteristics specific. Compress the output to be concise while retaining key visual details. MAX OUTPUT SIZE no more than 250 characters.\nDescription : {text}"},
+        ]
+    return messages
+
+
+def get_generate_kwargs(random_seed, max_tokens, options_config=None):
+    """Returns the sampling options for create_chat_completion."""
+    generate_kwargs = {
+        'max_tokens': max_tokens,
+        'temperature': 1.0,
+        'top_p': 0.9,
+        'top_k': 50,
+        'repeat_penalty': 1.2
+    }
+
+    if options_config:
+        for option in ['temperature', 'top_p', 'top_k', 'repeat_penalty']:
+            if option in options_config:
+                generate_kwargs[option] = options_config[option]
+
+    # The seed is applied per call, so a new seed takes effect without reloading the model.
+    generate_kwargs['seed'] = random_seed
+    return generate_kwargs
+
+
+_flux_json_grammar = None
+
+
+def get_flux_json_grammar():
+    """Returns the parsed FLUX_JSON_GRAMMAR, parsing it once."""
+    global _flux_json_grammar
+    if _flux_json_grammar is None:
+        _flux_json_grammar = llama_cpp.LlamaGrammar.from_string(FLUX_JSON_GRAMMAR, verbose=False)
+    return _flux_json_grammar
+
+
+# Responses being generated, by cache key, so a node waits for a pre-submitted generation of the
+# same request rather than generating it again.
+_pending_responses = {}
+_pending_responses_lock = threading.Lock()
+
+
+def generate_response(model, messages, random_seed, max_tokens, options_config=None, node_id=None,
+                      check_interrupt=True):
+    """Generates a response for the messages, from the response cache when we have one.
+
+    Generation is streamed to the node with `node_id`, can be interrupted, and by default stops as
+    soon as a JSON object response closes. With the `json_grammar` option, decoding is constrained
+    to FLUX_JSON_GRAMMAR. When `llm.worker_processes` is set, generation runs in a worker process.
+    """
+    generate_kwargs = get_generate_kwargs(random_seed, max_tokens, options_config)
+    load_options = get_load_options(options_config)
+    stop_at_json_end = (options_config or {}).get('stop_at_json_end', True)
+    json_grammar = (options_config or {}).get('json_grammar', False)
+
+    response_cache = get_response_cache()
+    cache_key = response_cache.get_key(model, {
+        'messages': messages,
+        'load': load_options,
+        'stop_at_json_end': stop_at_json_end,
+        'json_grammar': json_grammar,
+        **generate_kwargs,
+    })
+    response = response_cache.get(cache_key)
+    if response is not None:
+        print(f"Draekz LLM: Using cached response from '{model}'")
+        return response
+
+    with _pending_responses_lock:
+        future = _pending_responses.get(cache_key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _pending_responses[cache_key] = future
+    if not owner:
+        print(f"Draekz LLM: Waiting for a response already being generated by '{model}'")
+        while True:
+            if check_interrupt:
+                comfy.model_management.throw_exception_if_processing_interrupted()
+            try:
+                return future.result(timeout=0.25)
+            except FuturesTimeoutError:
+                continue
+            except Exception:  # pylint: disable = broad-exception-caught
+                # The other generation failed or was cancelled, so generate it ourselves.
+                return generate_response(model, messages, random_seed, max_tokens, options_config,
+                                         node_id=node_id, check_interrupt=check_interrupt)
+
+    try:
+        worker_pool = get_worker_pool()
+        if worker_pool is not None:
+            response = worker_pool.generate({
+                'model': model,
+                'model_path': get_model_path(model),
+                'load_options': get_llama_kwargs(load_options),
+                'prompt_cache_bytes': get_prompt_cache_bytes(),
+                'prime_messages': FEW_SHOT_MESSAGES if get_config_value('llm.prime_few_shot') is True else None,
+                'messages': messages,
+                'generate_kwargs': generate_kwargs,
+                'grammar': FLUX_JSON_GRAMMAR if json_grammar else None,
+            }, node_id=node_id, stop_at_json_end=stop_at_json_end, check_interrupt=check_interrupt)
+        else:
+            if json_grammar:
+                generate_kwargs['grammar'] = get_flux_json_grammar()
+            with get_llm_cache().lease(
+                model, lambda: load_model(model, load_options), load_params=load_options
+            ) as model_to_use:
+                response = stream_chat_completion(
+                    model_to_use, messages, generate_kwargs, node_id=node_id,
+                    stop_at_json_end=stop_at_json_end, check_interrupt=check_interrupt
+                )
+        response = response.strip()
+        response_cache.put(cache_key, response, model=model)
+        future.set_result(response)
+        return response
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _pending_responses_lock:
+            _pending_responses.pop(cache_key, None)
+
 
 class DraekzLLMPrompt:
     NAME = NODE_NAME
     CATEGORY = get_category()
 
-    # Class-level cache for the loaded model. This will persist between runs.
-    CACHED_MODELS = {}
-
     @classmethod
     def INPUT_TYPES(cls):
-        model_options = []
-        if os.path.isdir(GLOBAL_MODELS_DIR):
-            gguf_files = [file for file in os.listdir(GLOBAL_MODELS_DIR) if file.endswith('.gguf')]
-            model_options.extend(gguf_files)
-
         return {
             "required": {
                 "text": ("STRING", {"multiline": True, "dynamicPrompts": True, "default": ""}),
                 "random_seed": ("INT", {"default": 1234567890, "min": 0, "max": 0xffffffffffffffff}),
-                "model": (model_options,),
+                "model": (get_model_options(),),
                 "max_tokens": ("INT", {"default": 4096, "min": 1, "max": 8192}),
                 "apply_instructions": ("BOOLEAN", {"default": True}),
                 "instructions": ("STRING", {"multiline": False, "default": DEFAULT_INSTRUCTIONS}),
             },
             "optional": {
                 "options_config": ("DRAEKZLLMCONFIG",),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
@@ -54,81 +304,15 @@ class DraekzLLMPrompt:
     RETURN_TYPES = ("STRING", "STRING",)
     RETURN_NAMES = ("generated", "original",)
 
-    def main(self, text, random_seed, model, max_tokens, apply_instructions, instructions, options_config=None):
-        model_path = os.path.join(GLOBAL_MODELS_DIR, model)
-        model_to_use = None
-
-        # --- Caching Logic ---
-        # Check if the requested model is already loaded in our cache.
-        if model in self.CACHED_MODELS:
-            model_to_use = self.CACHED_MODELS[model]
-            print(f"Draekz LLM: Using cached model '{model}'")
-        else:
-            # If the model is not cached, clear the cache to free up memory from other models.
-            if self.CACHED_MODELS:
-                print(f"Draekz LLM: Clearing cached models to load a new one.")
-                self.CACHED_MODELS.clear()
-
-            # Load the new model from the file path.
-            print(f"Draekz LLM: Loading model '{model}'. This may take a moment...")
-
-            model_to_use = Llama(
-                model_path=model_path,
-                n_gpu_layers=-1,  # Offload all possible layers to GPU
-                seed=random_seed,
-                verbose=False,  # Suppress verbose output from llama.cpp
-                n_ctx=2048,  # Context window size
-            )
-
-            # Store the newly loaded model in the cache.
-            self.CACHED_MODELS[model] = model_to_use
-            print(f"Draekz LLM: Model '{model}' loaded and cached.")
-        # --- End Caching Logic ---
-
+    def main(self, text, random_seed, model, max_tokens, apply_instructions, instructions, options_config=None,
+             unique_id=None):
         if not model.endswith(".gguf"):
             return ("NOT A GGUF MODEL", text)
 
-        generate_kwargs = {
-            'max_tokens': max_tokens,
-            'temperature': 1.0,
-            'top_p': 0.9,
-            'top_k': 50,
-            'repeat_penalty': 1.2
-        }
-
-        if options_config:
-            for option in ['temperature', 'top_p', 'top_k', 'repeat_penalty']:
-                if option in options_config:
-                    generate_kwargs[option] = options_config[option]
-
-        if apply_instructions:
-            req = instructions.replace("{prompt}", text) if "{prompt}" in instructions else f"{instructions} {text}"
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user",
-                 "content": "An image generation prompt is a single paragraph summary to describe the subject and style of an image. It includes a description of the kind of image, the subject of the image, and some description of the image medium and style in the form of short keyword.\n\nCreate an image generation prompt for the subject \"a creepy creature shadow in the dark in a dimly lit tunnel\" in the style \"digital art illustration with intricate details\"."},
-                {"role": "assistant",
-                 "content": "Image Description: A digitally crafted illustration portrays a chilling scene within a dimly lit, cavernous tunnel. The dominant subject of the image is a mysterious creature, its form subtly discernible only as a menacing shadow on the walls of the tunnel. Its elongated silhouette suggests a serpentine creature with sharp protrusions and an ominous aura. The creature's eyes, a pair of glowing orbs, appear eerily human-like yet alien. The tunnel is riddled with intricate details that enhance the eerie atmosphere: dust particles floating lazily in the feeble light, ancient and crumbling stone, water droplets sparkling on the damp walls, and a hauntingly beautiful, bioluminescent fungi growing in the shadows. The dimly lit environment is highlighted by strategically placed light sources that create dramatic chiaroscuro effects, casting an unsettling and atmospheric glow on the scene. Digital Art Illustration with Intricate Details (Dark, Atmospheric, Suspenseful)"},
-                {"role": "user", "content": "Now compile the description and style into a single paragraph summary"},
-                {"role": "assistant",
-                 "content": "Digital art illustration featuring a dark, atmospheric, and suspenseful scene within a dimly lit, cavernous tunnel. The subject of the image is a mysterious creature, depicted only as a menacing shadow on the walls, with elongated silhouette and sharp protrusions. The creature's eyes, a pair of glowing orbs, appear eerily human-like yet alien. The tunnel is adorned with intricate details, such as dust particles, ancient crumbling stone, water droplets, and a hauntingly beautiful bioluminescent fungi growing in the shadows. Dramatic chiaroscuro effects are created through strategically placed light sources, casting an unsettling and atmospheric glow on the scene."},
-                {"role": "user", "content": "create a detailed summary without the title or style"},
-                {"role": "assistant",
-                 "content": "A dimly lit, cavernous tunnel is the setting for this chilling digital illustration. A mysterious creature lurks in the shadows, its elongated silhouette suggestive of a serpentine creature with sharp protrusions and an ominous aura. The creature's eyes, a pair of glowing orbs, appear eerily human-like yet alien. The tunnel is riddled with intricate details that enhance the eerie atmosphere: dust particles floating lazily in the feeble light, ancient and crumbling stone, water droplets sparkling on the damp walls, and a hauntingly beautiful, bioluminescent fungi growing in the shadows. Dramatic chiaroscuro effects are created through strategically placed light sources, casting an unsettling and atmospheric glow on the scene."},
-                {"role": "user",
-                 "content": "Generate a prompt from \"magical garden, sitting on a blue_bench, Disney Princess in pink_dress, blonde_hair, portrait, Pixar, Disney style, photorealistic, high details, detailed skin, pores, freckles\""},
-                {"role": "assistant",
-                 "content": "In a captivating, Pixar-inspired, Disney-style, photorealistic portrait, a magical garden unfolds as a breathtaking backdrop. The subject of the image is a Disney Princess, dressed elegantly in a pink gown with flowing fabric, sitting serenely on a blue bench. The princess boasts long, blonde hair and a radiant smile. The garden is meticulously detailed, with vibrant, enchanted flora and fauna, as well as whimsical details like sparkling fairy lights and a picturesque waterfall. The princess is highlighted against the lush, detailed foliage, with a focus on the high-definition details of her porcelain skin, visible freckles, and the intricacies of her elegant gown. The image is rendered in the captivating, photorealistic style that exemplifies both the Disney and Pixar brands, capturing the princess's timeless beauty and the magic of her enchanting surroundings."},
-                {"role": "user", "content": req},
-            ]
-        else:
-            messages = [
-                {"role": "system",
-                 "content": "You are a helpful assistant. Try your best to give the best response possible to the user."},
-                {"role": "user",
-                 "content": f"Create a detailed visually descriptive caption of this description, which will be used as a prompt for a text to image AI system (caption only, no instructions like \"create an image\").Remove any mention of digital artwork or artwork style. Give detailed visual descriptions of the character(s), including ethnicity, skin tone, expression etc. Imagine using keywords for a still for someone who has aphantasia. Describe the image style, e.g. any photographic or art styles / techniques utilized. Make sure to fully describe all aspects of the cinematography, with abundant technical details and visual descriptions. If there is more than one image, combine the elements and characters from all of the images creatively into a single cohesive composition with a single background, inventing an interaction between the characters. Be creative in combining the characters into a single cohesive scene. Focus on two primary characters (or one) and describe an interesting interaction between them, such as a hug, a kiss, a fight, giving an object, an emotional reaction / interaction. If there is more than one background in the images, pick the most appropriate one. Your output is only the caption itself, no comments or extra formatting. The caption is in a single long paragraph. If you feel the images are inappropriate, invent a new scene / characters inspired by these. Additionally, incorporate a specific movie director's visual style and describe the lighting setup in detail, including the type, color, and placement of light sources to create the desired mood and atmosphere. Always frame the scene, including details about the film grain, color grading, and any artifacts or characteristics specific. Compress the output to be concise while retaining key visual details. MAX OUTPUT SIZE no more than 250 characters.\nDescription : {text}"},
-            ]
+        messages = get_messages(text, apply_instructions, instructions)
+        response = generate_response(model, messages, random_seed, max_tokens, options_config,
+                                     node_id=unique_id)
+        return (response, text)
 
-        llm_result = model_to_use.create_chat_completion(messages, **generate_kwargs)
 
-        return (llm_result['choices'][0]['message']['content'].strip(), text)
+warm_up_models()
@@ -0,0 +1,79 @@
+# All nodes started from code provided thanks to SeargeDP
+# See license details in the main LICENSE.searge_llm file
+# https://github.com/SeargeDP/ComfyUI_Searge_LLM
+
+from .constants import get_category, get_name
+from .llm_prompt import DEFAULT_INSTRUCTIONS, generate_response, get_messages, get_model_options
+
+NODE_NAME = get_name('LLM Prompt Batch')
+
+class DraekzLLMPromptBatch:
+    """Expands many prompts in one execution, outputting lists for ComfyUI's list execution.
+
+    Each line of `texts` is a prompt or, when a list of strings is connected, each item is one
+    prompt, kept whole even if it spans lines. Each is generated `seeds_per_text` times with
+    consecutive seeds. Prompts run back to back on the same model, so the instruction prefix
+    evaluated for the first is reused by the rest, and each item goes through the response cache,
+    so only new items are generated.
+    """
+    NAME = NODE_NAME
+    CATEGORY = get_category()
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "texts": ("STRING", {"multiline": True, "dynamicPrompts": True, "default": "",
+                                     "tooltip": "One prompt per line."}),
+                "random_seed": ("INT", {"default": 1234567890, "min": 0, "max": 0xffffffffffffffff}),
+                "seeds_per_text": ("INT", {"default": 1, "min": 1, "max": 64}),
+                "model": (get_model_options(),),
+                "max_tokens": ("INT", {"default": 4096, "min": 1, "max": 8192}),
+                "apply_instructions": ("BOOLEAN", {"default": True}),
+                "instructions": ("STRING", {"multiline": False, "default": DEFAULT_INSTRUCTIONS}),
+            },
+            "optional": {
+                "options_config": ("DRAEKZLLMCONFIG",),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
+            }
+        }
+
+    INPUT_IS_LIST = True
+    FUNCTION = "main"
+    RETURN_TYPES = ("STRING", "STRING",)
+    RETURN_NAMES = ("generated", "original",)
+    OUTPUT_IS_LIST = (True, True,)
+
+    def main(self, texts, random_seed, seeds_per_text, model, max_tokens, apply_instructions,
+             instructions, options_config=None, unique_id=None):
+        # With INPUT_IS_LIST every input is a list; only `texts` is expected to have many items.
+        random_seed, seeds_per_text, model = random_seed[0], seeds_per_text[0], model[0]
+        max_tokens, apply_instructions = max_tokens[0], apply_instructions[0]
+        instructions = instructions[0]
+        options_config = options_config[0] if options_config else None
+        unique_id = unique_id[0] if unique_id else None
+
+        # A single string, from the widget or a connected string, has one prompt per line, while the
+        # items of a connected list are whole prompts.
+        if len(texts) == 1:
+            prompts = [line.strip() for line in texts[0].splitlines() if line.strip()]
+        else:
+            prompts = [text.strip() for text in texts if text.strip()]
+        if not prompts:
+            raise ValueError("LLM Prompt Batch has no prompts: enter one prompt per line in texts.")
+        if not model.endswith(".gguf"):
+            originals = [text for text in prompts for _ in range(seeds_per_text)]
+            return (["NOT A GGUF MODEL"] * len(originals), originals)
+
+        generated = []
+        originals = []
+        for text in prompts:
+            messages = get_messages(text, apply_instructions, instructions)
+            for i in range(seeds_per_text):
+                seed = (random_seed + i) % 0x10000000000000000
+                generated.append(generate_response(model, messages, seed, max_tokens, options_config,
+                                                   node_id=unique_id))
+                originals.append(text)
+        return (generated, originals)
@@ -3,72 +3,170 @@
 # https://github.com/rgthree/rgthree-comfy
 
 import os
-import folder_paths
 
 from .log import log_node_warn, log_node_info
+from .server.utils_model_catalog import get_model_catalog
 
-# pylint: disable = too-many-return-statements, too-many-branches
-def get_lora_by_filename(file_path, lora_paths=None, log_node=None):
-  lora_paths = lora_paths if lora_paths is not None else folder_paths.get_filename_list('loras')
+class LoraResolver:
+  """Resolves user entered lora names to lora files, using precomputed indexes.
 
-  if file_path in lora_paths:
-    return file_path
+  Matching is tried in tiers, from an exact path to just the file name without an extension, and
+  finally any path containing the input. Each exact tier is a dict lookup that keeps the first file
+  for a key, and the fuzzy tier narrows candidates with a trigram index before checking them.
+  """
 
-  lora_paths_no_ext = [os.path.splitext(x)[0] for x in lora_paths]
+  # The tier a file matched at, which decides how the match is logged.
+  TIER_EXACT = 0
+  TIER_DERIVED = 1
+  TIER_FILENAME = 2
+  TIER_FUZZY = 3
 
-  # See if we've entered the exact path, but without the extension
-  if file_path in lora_paths_no_ext:
-    found = lora_paths[lora_paths_no_ext.index(file_path)]
-    return found
+  def __init__(self, lora_paths):
+    self.lora_paths = tuple(lora_paths)
+    self.by_path = self._index(self.lora_paths)
+    self.by_no_ext = self._index(os.path.splitext(x)[0] for x in self.lora_paths)
+    self.by_filename = self._index(os.path.basename(x) for x in self.lora_paths)
+    self.by_filename_no_ext = self._index(
+      os.path.splitext(os.path.basename(x))[0] for x in self.lora_paths
+    )
+    self.trigrams = None
+    self.resolved = {}
 
-  # Same check, but ensure file_path is without extension.
-  file_path_force_no_ext = os.path.splitext(file_path)[0]
-  if file_path_force_no_ext in lora_paths_no_ext:
-    found = lora_paths[lora_paths_no_ext.index(file_path_force_no_ext)]
-    return found
+  @staticmethod
+  def _index(keys):
+    index = {}
+    for i, key in enumerate(keys):
+      index.setdefault(key, i)
+    return index
 
-  # See if we passed just the name, without paths.
-  lora_filenames_only = [os.path.basename(x) for x in lora_paths]
-  if file_path in lora_filenames_only:
-    found = lora_paths[lora_filenames_only.index(file_path)]
-    if log_node is not None:
-      log_node_info(log_node, f'Matched Lora input "{file_path}" to "{found}".')
-    return found
+  def _get_trigrams(self):
+    if self.trigrams is None:
+      self.trigrams = {}
+      for i, lora_path in enumerate(self.lora_paths):
+        for j in range(len(lora_path) - 2):
+          self.trigrams.setdefault(lora_path[j:j + 3], set()).add(i)
+    return self.trigrams
 
-  # Same, but force the input to be without paths
-  file_path_force_filename = os.path.basename(file_path)
-  lora_filenames_only = [os.path.basename(x) for x in lora_paths]
-  if file_path_force_filename in lora_filenames_only:
-    found = lora_paths[lora_filenames_only.index(file_path_force_filename)]
-    if log_node is not None:
-      log_node_info(log_node, f'Matched Lora input "{file_path}" to "{found}".')
-    return found
+  def _fuzzy_find(self, file_path):
+    """Returns the index of the first lora path containing file_path, or None."""
+    if len(file_path) < 3:
+      candidates = range(len(self.lora_paths))
+    else:
+      trigrams = self._get_trigrams()
+      sets = [trigrams.get(file_path[j:j + 3]) for j in range(len(file_path) - 2)]
+      if any(s is None for s in sets):
+        return None
+      candidates = sorted(set.intersection(*sorted(sets, key=len)))
+    return next((i for i in candidates if file_path in self.lora_paths[i]), None)
 
-  # Check the filenames and without extension.
-  lora_filenames_and_no_ext = [os.path.splitext(os.path.basename(x))[0] for x in lora_paths]
-  if file_path in lora_filenames_and_no_ext:
-    found = lora_paths[lora_filenames_and_no_ext.index(file_path)]
-    if log_node is not None:
-      log_node_info(log_node, f'Matched Lora input "{file_path}" to "{found}".')
-    return found
+  def _resolve(self, file_path):
+    """Returns the index of the matching lora path and the tier it matched at."""
+    if file_path in self.by_path:
+      return self.by_path[file_path], self.TIER_EXACT
+
+    # See if we've entered the exact path, but without the extension, or with a different one.
+    for key in (file_path, os.path.splitext(file_path)[0]):
+      if key in self.by_no_ext:
+        return self.by_no_ext[key], self.TIER_DERIVED
+
+    # See if we passed just the name, without paths, and then also without the extension.
+    filename = os.path.basename(file_path)
+    for index, key in ((self.by_filename, file_path), (self.by_filename, filename),
+                       (self.by_filename_no_ext, file_path),
+                       (self.by_filename_no_ext, os.path.splitext(filename)[0])):
+      if key in index:
+        return index[key], self.TIER_FILENAME
+
+    # Finally, super fuzzy, we'll just check if the input exists in the path at all.
+    found = self._fuzzy_find(file_path)
+    if found is not None:
+      return found, self.TIER_FUZZY
+    return None, None
 
-  # And, one last forcing the input to be the same
-  file_path_force_filename_and_no_ext = os.path.splitext(os.path.basename(file_path))[0]
-  if file_path_force_filename_and_no_ext in lora_filenames_and_no_ext:
-    found = lora_paths[lora_filenames_and_no_ext.index(file_path_force_filename_and_no_ext)]
+  def resolve(self, file_path, log_node=None):
+    """Returns the matching lora file for the input, or None."""
+    if file_path not in self.resolved:
+      self.resolved[file_path] = self._resolve(file_path)
+    index, tier = self.resolved[file_path]
+    found = self.lora_paths[index] if index is not None else None
     if log_node is not None:
-      log_node_info(log_node, f'Matched Lora input "{file_path}" to "{found}".')
+      if found is None:
+        log_node_warn(log_node, f'Lora "{file_path}" not found, skipping.')
+      elif tier == self.TIER_FILENAME:
+        log_node_info(log_node, f'Matched Lora input "{file_path}" to "{found}".')
+      elif tier == self.TIER_FUZZY:
+        log_node_warn(log_node, f'Fuzzy-matched Lora input "{file_path}" to "{found}".')
     return found
 
-  # Finally, super fuzzy, we'll just check if the input exists in the path at all.
-  for index, lora_path in enumerate(lora_paths):
-    if file_path in lora_path:
-      found = lora_paths[index]
-      if log_node is not None:
-        log_node_warn(log_node, f'Fuzzy-matched Lora input "{file_path}" to "{found}".')
-      return found
 
-  if log_node is not None:
-    log_node_warn(log_node, f'Lora "{file_path}" not found, skipping.')
+# The resolver for the loras folders, with the model catalog version it was built at.
+_catalog_resolver = (None, None)
+_resolver = None
+
+
+def get_lora_resolver(lora_paths=None) -> LoraResolver:
+  """Returns a resolver for the lora paths, or for the loras folders when none are provided.
+
+  The loras folders' resolver is rebuilt only when the model catalog's version changes, which
+  costs a stat per lora directory rather than a pass over every lora. A resolver for provided paths
+  is reused while the same paths are provided.
+  """
+  global _catalog_resolver, _resolver
+  if lora_paths is None:
+    catalog = get_model_catalog('loras')
+    version, resolver = _catalog_resolver
+    if resolver is None or version != catalog.get_version():
+      # Read the version first, so a change while listing rebuilds the resolver next time.
+      version = catalog.get_version()
+      resolver = LoraResolver(catalog.get_files())
+      _catalog_resolver = (version, resolver)
+    return resolver
+
+  resolver = _resolver
+  if resolver is None or resolver.lora_paths != tuple(lora_paths):
+    resolver = LoraResolver(lora_paths)
+    _resolver = resolver
+  return resolver
+
+
+def get_lora_by_filename(file_path, lora_paths=None, log_node=None):
+  """Gets the lora file matching the input, which may be a path, file name, or partial name."""
+  return get_lora_resolver(lora_paths).resolve(file_path, log_node=log_node)
+
+
+def get_enabled_loras(inputs: dict, has_clip=True, log_node=None) -> list:
+  """Returns the enabled loras of a Lora Loader's inputs, with their files and strengths.
 
-  return None
+  This is the one place that decides which loras a loader applies, for the node itself and for
+  anything looking at a queued prompt ahead of it. A lora is enabled when it's on, its file is
+  found, and it has a non-zero model strength, or clip strength when there's a clip. Each is a dict
+  of its `name`, `file`, `strength_model`, `strength_clip`, and the `value` of its input.
+  """
+  loras = []
+  for key, value in inputs.items():
+    if not key.upper().startswith('LORA_') or not isinstance(value, dict):
+      continue
+    if 'on' not in value or not isinstance(value.get('lora'), str) or 'strength' not in value:
+      continue
+    strength_model = value['strength']
+    # If we just passed one strength value, then use it for both, if we passed a strengthTwo as
+    # well, then our `strength` will be for the model, and `strengthTwo` for clip.
+    strength_clip = value['strengthTwo'] if 'strengthTwo' in value else None
+    if not has_clip:
+      if strength_clip is not None and strength_clip != 0 and log_node is not None:
+        log_node_warn(log_node, 'Received clip strength even though no clip supplied!')
+      strength_clip = 0
+    elif strength_clip is None:
+      strength_clip = strength_model
+    if not value['on'] or (strength_model == 0 and strength_clip == 0):
+      continue
+    lora = get_lora_by_filename(value['lora'], log_node=log_node)
+    if lora is not None:
+      loras.append({
+        'name': value['lora'],
+        'file': lora,
+        'strength_model': strength_model,
+        'strength_clip': strength_clip,
+        'value': value,
+      })
+  return loras
@@ -10,6 +10,8 @@ from ..config import get_config_value
 from .utils_server import set_default_page_resources, set_default_page_routes
 from .routes_config import *
 from .routes_model_info import *
+from .routes_lora import *
+from .routes_llm import *
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 DIR_WEB = os.path.abspath(f'{THIS_DIR}/../../web/')
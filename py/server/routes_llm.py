@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from server import PromptServer
+
+from ..config import get_config_value
+from ..constants import get_name
+from ..utils_llm import get_llm_cache, get_response_cache, get_worker_pool
+from .utils_server import run_blocking
+
+routes = PromptServer.instance.routes
+
+_LLM_PROMPT_NAME = get_name('LLM Prompt')
+_LLM_OPTIONS_NAME = get_name('LLM Options')
+_PRESUBMIT_INPUTS = [
+  'text', 'random_seed', 'model', 'max_tokens', 'apply_instructions', 'instructions'
+]
+
+_presubmit_executor = None
+
+
+def _get_literal_inputs(node: dict, names=None):
+  """Returns a node's inputs if they're all values rather than links to other nodes, else None."""
+  inputs = node.get('inputs') or {}
+  if names is not None and any(name not in inputs for name in names):
+    return None
+  # Links to other nodes' outputs are given as [node_id, output_index].
+  if any(isinstance(value, list) for value in inputs.values()):
+    return None
+  return inputs
+
+
+def get_presubmittable_requests(prompt: dict) -> list:
+  """Returns generate_response arguments for LLM Prompt nodes whose inputs are known up front.
+
+  That's nodes with literal inputs, and an options config that's either absent or from an LLM
+  Options node with literal inputs.
+  """
+  # Imported here since it loads llama_cpp.
+  from ..llm_options import DraekzLLMOptions  # pylint: disable = import-outside-toplevel
+  from ..llm_prompt import get_messages  # pylint: disable = import-outside-toplevel
+  requests = []
+  for node_id, node in prompt.items():
+    if not isinstance(node, dict) or node.get('class_type') != _LLM_PROMPT_NAME:
+      continue
+    inputs = dict(node.get('inputs') or {})
+    options_link = inputs.pop('options_config', None)
+    inputs = _get_literal_inputs({'inputs': inputs}, _PRESUBMIT_INPUTS)
+    if inputs is None:
+      continue
+    options_config = None
+    if options_link is not None:
+      options_node = prompt.get(str(options_link[0])) if isinstance(options_link, list) else None
+      options_inputs = _get_literal_inputs(options_node) if isinstance(options_node, dict) else None
+      if options_inputs is None or options_node.get('class_type') != _LLM_OPTIONS_NAME:
+        continue
+      options_config = DraekzLLMOptions().main(**options_inputs)[0]
+    requests.append({
+      'node_id': node_id,
+      'model': inputs['model'],
+      'messages': get_messages(
+        inputs['text'], inputs['apply_instructions'], inputs['instructions']
+      ),
+      'random_seed': inputs['random_seed'],
+      'max_tokens': inputs['max_tokens'],
+      'options_config': options_config,
+    })
+  return requests
+
+
+def _presubmit(request: dict):
+  from ..llm_prompt import generate_response  # pylint: disable = import-outside-toplevel
+  try:
+    generate_response(
+      request['model'],
+      request['messages'],
+      request['random_seed'],
+      request['max_tokens'],
+      request['options_config'],
+      check_interrupt=False
+    )
+  except Exception as e:  # pylint: disable = broad-exception-caught
+    print(f'Draekz LLM: Pre-submitted generation for node {request["node_id"]} failed: {e}')
+
+
+def on_prompt_presubmit_llm(json_data):
+  """Starts generating a queued prompt's LLM responses in the worker processes.
+
+  Responses land in the response cache, so by the time the prompt runs its LLM Prompt nodes can
+  use them, while the prompts ahead of it were sampling.
+  """
+  global _presubmit_executor
+  try:
+    worker_pool = get_worker_pool()
+    if worker_pool is None:
+      return json_data
+    requests = get_presubmittable_requests(json_data.get('prompt') or {})
+    if requests and _presubmit_executor is None:
+      _presubmit_executor = ThreadPoolExecutor(
+        max_workers=worker_pool.size, thread_name_prefix='draekz_llm_presubmit'
+      )
+    for request in requests:
+      if request['model'].endswith('.gguf'):
+        _presubmit_executor.submit(_presubmit, request)
+  except Exception as e:  # pylint: disable = broad-exception-caught
+    print(f'Draekz LLM: Could not pre-submit prompt: {e}')
+  return json_data
+
+
+if get_config_value('llm.presubmit_queued_prompts') is True:
+  PromptServer.instance.add_on_prompt_handler(on_prompt_presubmit_llm)
+
+
+@routes.get('/draekz/api/llm/models')
+async def api_get_llm_models(request):
+  """Returns the loaded LLM models and the cache's pins and RAM budget, and any worker processes."""
+  return web.json_response({'status': 200, **await run_blocking(_get_status)})
+
+
+def _get_status():
+  worker_pool = get_worker_pool()
+  return {
+    **get_llm_cache().get_status(),
+    'workers': worker_pool.get_status() if worker_pool is not None else [],
+  }
+
+
+@routes.post('/draekz/api/llm/unload')
+async def api_post_unload_llm_models(request):
+  """Unloads an LLM model given as `model`, or all unpinned models (`pinned: true` for all).
+
+  Unloading all models also stops idle worker processes, which free their models with them.
+  """
+  data = await request.json()
+  cache = get_llm_cache()
+  if data.get('model'):
+    unloaded = [data['model']] if await run_blocking(cache.unload, data['model']) else []
+  else:
+    unloaded = await run_blocking(cache.unload_all, include_pinned=data.get('pinned') is True)
+    worker_pool = get_worker_pool()
+    if worker_pool is not None:
+      unloaded += await run_blocking(worker_pool.unload_all)
+  return web.json_response({'status': 200, 'unloaded': unloaded})
+
+
+@routes.post('/draekz/api/llm/pin')
+async def api_post_pin_llm_model(request):
+  """Pins an LLM model given as `model` so it isn't evicted, or unpins it with `pinned: false`."""
+  data = await request.json()
+  if not data.get('model'):
+    return web.json_response({'status': 400, 'error': 'No model provided'})
+  cache = get_llm_cache()
+  await run_blocking(cache.set_pinned, data['model'], data.get('pinned') is not False)
+  return web.json_response({'status': 200, **await run_blocking(cache.get_status)})
+
+
+@routes.post('/draekz/api/llm/responses/clear')
+async def api_post_clear_llm_responses(request):
+  """Clears the cached LLM responses, in memory and on disk."""
+  await run_blocking(get_response_cache().clear)
+  return web.json_response({'status': 200})
@@ -0,0 +1,79 @@
+import copy
+
+from aiohttp import web
+
+from server import PromptServer
+
+from ..config import get_config_value
+from ..constants import get_name
+from ..prompt_utils import get_enabled_loras, get_lora_by_filename
+from ..utils_lora import prefetch_loras, submit_prefetch
+from .utils_server import run_blocking
+
+routes = PromptServer.instance.routes
+
+_LORA_LOADER_NAME = get_name('Lora Loader')
+
+
+def get_enabled_loras_from_prompt(prompt: dict) -> list:
+  """Returns the lora files enabled in any Lora Loader nodes of a server prompt."""
+  loras = []
+  for node in _get_lora_loader_nodes(prompt):
+    inputs = node.get('inputs') or {}
+    for lora in get_enabled_loras(inputs, has_clip='clip' in inputs):
+      if lora['file'] not in loras:
+        loras.append(lora['file'])
+  return loras
+
+
+def _get_lora_loader_nodes(prompt: dict) -> list:
+  return [
+    node for node in prompt.values()
+    if isinstance(node, dict) and node.get('class_type') == _LORA_LOADER_NAME
+  ]
+
+
+def _prefetch_prompt_loras(prompt: dict):
+  try:
+    prefetch_loras(get_enabled_loras_from_prompt(prompt))
+  except Exception as e:  # pylint: disable = broad-exception-caught
+    print(f'Could not prefetch loras for prompt: {e}')
+
+
+def on_prompt_prefetch_loras(json_data):
+  """Starts loading a queued prompt's loras in the background, before its loader nodes run.
+
+  This runs on the event loop, so resolving the loras, which can scan the loras folders, is done
+  on the prefetch thread with a copy of the prompt's loader nodes.
+  """
+  prompt = json_data.get('prompt')
+  if isinstance(prompt, dict):
+    nodes = copy.deepcopy(_get_lora_loader_nodes(prompt))
+    if nodes:
+      submit_prefetch(_prefetch_prompt_loras, dict(enumerate(nodes)))
+  return json_data
+
+
+if get_config_value('lora_loader.prefetch_on_prompt') is not False:
+  PromptServer.instance.add_on_prompt_handler(on_prompt_prefetch_loras)
+
+
+def _prefetch_loras_from_request(data: dict) -> list:
+  if 'prompt' in data:
+    loras = get_enabled_loras_from_prompt(data['prompt'] or {})
+  else:
+    loras = [lora for lora in (get_lora_by_filename(l) for l in data.get('loras') or []) if lora]
+  return prefetch_loras(loras)
+
+
+@routes.post('/draekz/api/loras/prefetch')
+async def api_post_prefetch_loras(request):
+  """Prefetches loras given as a list of names, or those enabled in a prompt, into the cache."""
+  try:
+    data = await request.json()
+  except ValueError:
+    return web.json_response({'status': 400, 'error': 'Invalid JSON body'}, status=400)
+  if not isinstance(data, dict):
+    return web.json_response({'status': 400, 'error': 'Expected a JSON object'}, status=400)
+  queued = await run_blocking(_prefetch_loras_from_request, data)
+  return web.json_response({'status': 200, 'queued': queued})
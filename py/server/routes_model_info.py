@@ -2,19 +2,41 @@
 # See license details in the main LICENSE.rgthree file
 # https://github.com/rgthree/rgthree-comfy
 
-import os
+import asyncio
 import json
 from aiohttp import web
 
 from server import PromptServer
 import folder_paths
 
+from ..config import get_config_value
 from ..utils import path_exists
-from .utils_server import get_param, is_param_falsy
-from .utils_info import delete_model_info, get_model_info, set_model_info_partial, get_file_info
+from .utils_server import get_param, get_int_param, is_param_falsy, run_blocking, get_etag, is_etag_fresh
+from .utils_model_catalog import get_model_catalog, get_version_token, parse_version_token
+from .utils_info import delete_model_info, get_model_info, set_model_info_partial, get_files_info
+from .utils_info import get_folder_path, get_models_info_light, get_file_info
+from .utils_thumbnail import get_thumbnail, THUMBNAIL_ERRORS
+from .utils_info import import_model_info, export_model_info
+from .utils_hash import hash_files
 
 routes = PromptServer.instance.routes
 
+# Running prehash jobs, by model type, so repeated calls report on the existing job.
+_PREHASH_JOBS = {}
+
+VERSION_HEADER = 'X-Draekz-Version'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# The most hashing threads a prehash request can ask for.
+PREHASH_MAX_WORKERS = 32
+# The most models a model info request can ask to process concurrently.
+INFO_MAX_WORKERS = 32
+
+# Image urls from the catalog carry a `v` param that changes with the image, so those can be cached
+# for good. Unversioned urls are revalidated after a minute.
+IMG_VERSIONED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+IMG_CACHE_CONTROL = 'public, max-age=60, stale-while-revalidate=3600'
+
 
 def _check_valid_model_type(request):
   model_type = request.match_info['type']
@@ -28,29 +50,46 @@ async def api_get_models_list(request):
   """Returns a list of model types from user configuration.
 
   By default, a list of filenames are provided. If `format=details` is specified, a list of objects
-  with additional _file info_ is provided. This includes modigied time, hasInfoFile, and imageLocal
-  among others.
+  with additional _file info_ is provided. This includes modified time, hasInfoFile, and imageLocal
+  among others, answered from the in-memory model catalog.
+
+  Responses carry an ETag and an `X-Draekz-Version` header. Passing that version back as `since`
+  returns only the changes since then, as `{version, changed, removed}`.
   """
   if _check_valid_model_type(request):
     return _check_valid_model_type(request)
 
   model_type = request.match_info['type']
+  since = parse_version_token(get_param(request, 'since'))
+  version, changed, removed = await run_blocking(
+    get_model_catalog(model_type).changed_since, since or 0
+  )
+  headers = _get_version_headers(request, version)
+  if is_etag_fresh(request, headers['ETag']):
+    return web.Response(status=304, headers=headers)
+
   files = folder_paths.get_filename_list(model_type)
   format_param = get_param(request, 'format')
+  if since is not None:
+    files_set = set(files)
+    files = [file for file in changed if file in files_set]
   if format_param == 'details':
-    response = []
-    for file in files:
-      response.append(get_file_info(file, model_type))
-    return web.json_response(response)
-
-  return web.json_response(list(files))
+    files = await run_blocking(get_files_info, files, model_type)
+  if since is not None:
+    return web.json_response(
+      {'version': headers[VERSION_HEADER], 'changed': list(files), 'removed': removed},
+      headers=headers
+    )
+  return web.json_response(list(files), headers=headers)
 
 
 @routes.get('/draekz/api/{type}/info')
 async def api_get_models_info(request):
   """Returns a list model info; either all or a specific ones if provided a 'files' param.
 
-  If a `light` param is specified and not falsy, no metadata will be fetched.
+  If a `light` param is specified and not falsy, no metadata will be fetched. Pass `format=ndjson`
+  to stream each model's info as it's ready. Like the models list, responses are versioned with an
+  ETag and `X-Draekz-Version`, and a `since` param returns only changed and removed models.
   """
   if _check_valid_model_type(request):
     return _check_valid_model_type(request)
@@ -60,10 +99,40 @@ async def api_get_models_info(request):
   maybe_fetch_metadata = files_param is not None
   if not is_param_falsy(request, 'light'):
     maybe_fetch_metadata = False
-  api_response = await models_info_response(
-    request, model_type, maybe_fetch_metadata=maybe_fetch_metadata
+
+  since = parse_version_token(get_param(request, 'since'))
+  version, changed, removed = await run_blocking(
+    get_model_catalog(model_type).changed_since, since or 0
   )
-  return web.json_response(api_response)
+  headers = _get_version_headers(request, version)
+  if is_etag_fresh(request, headers['ETag']):
+    return web.Response(status=304, headers=headers)
+
+  files = files_param.split(',') if files_param is not None else None
+  if since is None:
+    removed = None
+  else:
+    files_set = set(files) if files is not None else set(folder_paths.get_filename_list(model_type))
+    files = [file for file in changed if file in files_set]
+    removed = [file for file in removed if file not in files_set]
+  return await models_info_response(
+    request,
+    model_type,
+    maybe_fetch_metadata=maybe_fetch_metadata,
+    files=files,
+    removed=removed,
+    headers=headers
+  )
+
+
+def _get_version_headers(request, version: int):
+  """Returns the caching headers for a catalog versioned response."""
+  version_token = get_version_token(version)
+  return {
+    'ETag': get_etag(version_token, request.path_qs),
+    'Cache-Control': 'no-cache',
+    VERSION_HEADER: version_token,
+  }
 
 
 @routes.get('/draekz/api/{type}/info/refresh')
@@ -73,10 +142,67 @@ async def api_get_refresh_get_models_info(request):
     return _check_valid_model_type(request)
 
   model_type = request.match_info['type']
-  api_response = await models_info_response(
+  return await models_info_response(
     request, model_type, maybe_fetch_civitai=True, maybe_fetch_metadata=True
   )
-  return web.json_response(api_response)
+
+
+@routes.get('/draekz/api/{type}/info/prehash')
+async def api_get_prehash_models(request):
+  """Hashes all models (or those in a 'files' param) in the background to fill the hash index.
+
+  Returns immediately; progress is sent as `draekz-prehash-{type}` events. The `workers` and
+  `readers_per_disk` params tune the parallelism.
+  """
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+
+  model_type = request.match_info['type']
+  job = _PREHASH_JOBS.get(model_type)
+  if job is not None and not job['task'].done():
+    return web.json_response({'status': 200, 'data': job['progress']})
+
+  try:
+    # 0 workers sizes the pool from the number of disks and readers per disk.
+    workers = get_int_param(request, 'workers', 0, 0, PREHASH_MAX_WORKERS) or None
+    readers_per_disk = get_int_param(request, 'readers_per_disk', 2, 1, PREHASH_MAX_WORKERS)
+  except ValueError:
+    return web.json_response(
+      {'status': 400, 'error': 'workers and readers_per_disk must be integers'}, status=400
+    )
+
+  files_param = get_param(request, 'files')
+  if files_param is not None:
+    files_param = files_param.split(',')
+  else:
+    files_param = folder_paths.get_filename_list(model_type)
+  file_paths = await run_blocking(
+    lambda: [path for path in (get_folder_path(f, model_type) for f in files_param) if path]
+  )
+
+  progress = {'running': True, 'done': 0, 'total': len(file_paths)}
+  event = f'draekz-prehash-{model_type}'
+
+  def on_progress(done, total, file_path):
+    progress['done'] = done
+    PromptServer.instance.send_sync(event, {**progress, 'file': file_path})
+
+  async def run():
+    try:
+      await asyncio.get_running_loop().run_in_executor(
+        None, lambda: hash_files(
+          file_paths,
+          max_workers=workers,
+          max_readers_per_disk=readers_per_disk,
+          on_progress=on_progress
+        )
+      )
+    finally:
+      progress['running'] = False
+      await PromptServer.instance.send(event, progress)
+
+  _PREHASH_JOBS[model_type] = {'task': asyncio.create_task(run()), 'progress': progress}
+  return web.json_response({'status': 200, 'data': progress})
 
 
 @routes.get('/draekz/api/{type}/info/clear')
@@ -111,6 +237,39 @@ async def api_get_delete_model_info(request):
   return web.json_response(api_response)
 
 
+@routes.get('/draekz/api/{type}/info/export')
+async def api_get_export_models_info(request):
+  """Writes stored model info to draekz-info.json files next to the models.
+
+  Exports the provided 'files', or all models if none are provided.
+  """
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+  return await _sidecar_response(request, export_model_info)
+
+
+@routes.get('/draekz/api/{type}/info/import')
+async def api_get_import_models_info(request):
+  """Reads draekz-info.json files next to the models into the model info store.
+
+  Imports the provided 'files', or all models if none are provided.
+  """
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+  return await _sidecar_response(request, import_model_info)
+
+
+async def _sidecar_response(request, fn):
+  model_type = request.match_info['type']
+  files_param = get_param(request, 'files')
+  if files_param is not None:
+    files_param = files_param.split(',')
+  else:
+    files_param = folder_paths.get_filename_list(model_type)
+  count = await run_blocking(lambda: sum(1 for f in files_param if fn(f, model_type)))
+  return web.json_response({'status': 200, 'data': {'count': count, 'total': len(files_param)}})
+
+
 @routes.post('/draekz/api/{type}/info')
 async def api_post_save_model_data(request):
   """Saves data to a model by name. """
@@ -133,22 +292,22 @@ async def api_post_save_model_data(request):
 
 @routes.get('/draekz/api/{type}/img')
 async def api_get_models_info_img(request):
-  """ Returns an image response if one exists for the model. """
+  """ Returns an image response if one exists for the model.
+
+  Pass a `size` param to get a resized thumbnail no larger than size x size, encoded as `webp`
+  (default) or `jpeg` per a `format` param. Thumbnails are cached in userdata, keyed by the source
+  image's mtime. If the image can't be resized, the original is returned.
+
+  Browsers cache urls with a `v` param, like the `imageLocal` urls, indefinitely since the version
+  changes with the image.
+  """
   if _check_valid_model_type(request):
     return _check_valid_model_type(request)
 
   model_type = request.match_info['type']
   file_param = get_param(request, 'file')
-  file_path = folder_paths.get_full_path(model_type, file_param)
-  if not path_exists(file_path):
-    file_path = os.path.abspath(file_path)
-
-  img_path = None
-  for ext in ['jpg', 'png', 'jpeg']:
-    try_path = f'{os.path.splitext(file_path)[0]}.{ext}'
-    if path_exists(try_path):
-      img_path = try_path
-      break
+  file_info = await run_blocking(get_file_info, file_param, model_type) if file_param else None
+  img_path = file_info['imagePath'] if file_info is not None else None
 
   if not path_exists(img_path):
     api_response = {}
@@ -156,27 +315,103 @@ async def api_get_models_info_img(request):
     api_response['error'] = 'No model found at path'
     return web.json_response(api_response)
 
-  return web.FileResponse(img_path)
+  is_versioned = get_param(request, 'v') is not None
+  headers = {'Cache-Control': IMG_VERSIONED_CACHE_CONTROL if is_versioned else IMG_CACHE_CONTROL}
+  size_param = get_param(request, 'size')
+  if size_param is not None and size_param.isdigit():
+    try:
+      thumbnail_path, content_type = await get_thumbnail(
+        img_path, int(size_param), get_param(request, 'format', 'webp')
+      )
+      return web.FileResponse(thumbnail_path, headers={**headers, 'Content-Type': content_type})
+    except THUMBNAIL_ERRORS as e:
+      print(f'Could not create thumbnail for {img_path}: {e}')
+
+  return web.FileResponse(img_path, headers=headers)
 
 
 async def models_info_response(
-  request, model_type, maybe_fetch_civitai=False, maybe_fetch_metadata=False
+  request,
+  model_type,
+  maybe_fetch_civitai=False,
+  maybe_fetch_metadata=False,
+  files=None,
+  removed=None,
+  headers=None
 ):
-  """Gets model info for all or a single model type."""
-  api_response = {'status': 200, 'data': []}
-  light = not is_param_falsy(request, 'light')
-  files_param = get_param(request, 'files')
-  if files_param is not None:
-    files_param = files_param.split(',')
-  else:
-    files_param = folder_paths.get_filename_list(model_type)
-  for file_param in files_param:
-    info_data = await get_model_info(
-      file_param,
-      model_type,
-      maybe_fetch_civitai=maybe_fetch_civitai,
-      maybe_fetch_metadata=maybe_fetch_metadata,
-      light=light
+  """Gets a model info response for the provided files, or the 'files' param, or all models.
+
+  Files are processed concurrently, bounded by a `workers` param (or `server.info_workers` config).
+  By default a single json response is returned in file order. With `format=ndjson` each model's
+  info is streamed on its own line as soon as it's ready, in completion order. When a list of
+  `removed` files is provided (for delta responses), it's included in the response.
+  """
+  try:
+    workers = get_int_param(
+      request, 'workers', get_config_value('server.info_workers') or 8, 1, INFO_MAX_WORKERS
     )
-    api_response['data'].append(info_data)
-  return api_response
+  except ValueError:
+    return web.json_response({'status': 400, 'error': 'workers must be an integer'}, status=400)
+
+  light = not is_param_falsy(request, 'light')
+  files_param = files
+  all_files = False
+  if files_param is None:
+    files_param = get_param(request, 'files')
+    if files_param is not None:
+      files_param = files_param.split(',')
+    else:
+      files_param = folder_paths.get_filename_list(model_type)
+      all_files = True
+  is_ndjson = get_param(request, 'format') == 'ndjson'
+  json_extra = {'removed': removed} if removed is not None else {}
+  if headers and VERSION_HEADER in headers:
+    json_extra['version'] = headers[VERSION_HEADER]
+
+  if is_ndjson:
+    response = web.StreamResponse(headers={**(headers or {}), 'Content-Type': NDJSON_CONTENT_TYPE})
+    await response.prepare(request)
+    if removed:
+      await response.write(_to_ndjson({'file': file, 'removed': True} for file in removed))
+
+  if light and not maybe_fetch_civitai and not maybe_fetch_metadata:
+    # Light info only needs stored data, which is read for all files at once.
+    data = await run_blocking(get_models_info_light, files_param, model_type, all_files=all_files)
+    if not is_ndjson:
+      return web.json_response({'status': 200, 'data': data, **json_extra}, headers=headers)
+    await response.write(_to_ndjson(data))
+    await response.write_eof()
+    return response
+
+  semaphore = asyncio.Semaphore(workers)
+
+  async def get_info(file_param):
+    async with semaphore:
+      return await get_model_info(
+        file_param,
+        model_type,
+        maybe_fetch_civitai=maybe_fetch_civitai,
+        maybe_fetch_metadata=maybe_fetch_metadata,
+        light=light
+      )
+
+  tasks = [asyncio.ensure_future(get_info(file_param)) for file_param in files_param]
+  if not is_ndjson:
+    data = list(await asyncio.gather(*tasks))
+    return web.json_response({'status': 200, 'data': data, **json_extra}, headers=headers)
+
+  try:
+    for task in asyncio.as_completed(tasks):
+      info_data = await task
+      await response.write(_to_ndjson([info_data]))
+  finally:
+    # If the client went away, don't keep working on its behalf.
+    for task in tasks:
+      task.cancel()
+  await response.write_eof()
+  return response
+
+
+def _to_ndjson(items) -> bytes:
+  """Encodes items as newline delimited json."""
+  return ''.join(json.dumps(item) + '\n' for item in items).encode('utf-8')
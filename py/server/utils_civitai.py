@@ -0,0 +1,128 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+from ..config import get_config_value
+from ..pyproject import VERSION
+
+# Statuses that are worth retrying; everything else (including 404 for unknown hashes) is final.
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+  """A simple async token bucket allowing `rate` acquisitions per second, bursting to `capacity`."""
+
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  async def acquire(self):
+    """Waits until a token is available, and takes it."""
+    if self.rate <= 0:
+      return
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CivitaiClient:
+  """An async civitai api client sharing one keep-alive session across all requests.
+
+  Requests are limited to `concurrency` in flight, and `requests_per_second` started, and are
+  retried with exponential backoff when civitai responds with a 429 or 5xx (or the request fails).
+  The `api_base` can be pointed at a local stub server for testing.
+  """
+
+  def __init__(
+    self,
+    api_base='https://civitai.com/api/v1',
+    concurrency=4,
+    requests_per_second=2.0,
+    max_retries=4,
+    timeout=30
+  ):
+    self.api_base = api_base.rstrip('/')
+    self.concurrency = max(1, concurrency)
+    self.max_retries = max_retries
+    self.timeout = aiohttp.ClientTimeout(total=timeout)
+    self.bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+    self.semaphore = asyncio.Semaphore(self.concurrency)
+    self.session = None
+
+  def _get_session(self):
+    if self.session is None or self.session.closed:
+      self.session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+        timeout=self.timeout,
+        headers={"user-agent": f"comfyui-draekz-nodez/{VERSION}"},
+      )
+    return self.session
+
+  def get_model_version_by_hash_url(self, file_hash: str):
+    """Returns the api url for a model version by its file hash."""
+    return f'{self.api_base}/model-versions/by-hash/{file_hash}'
+
+  async def get_model_version_by_hash(self, file_hash: str):
+    """Returns the model version json for a file hash, or None if it couldn't be fetched."""
+    return await self.get_json(self.get_model_version_by_hash_url(file_hash))
+
+  async def get_json(self, url: str):
+    """Gets json from a url, retrying with backoff. Returns None when all attempts fail."""
+    async with self.semaphore:
+      for attempt in range(self.max_retries + 1):
+        await self.bucket.acquire()
+        retry_after = None
+        try:
+          async with self._get_session().get(url) as response:
+            if response.status not in _RETRY_STATUSES:
+              try:
+                return await response.json(content_type=None)
+              except ValueError:
+                # A final status with a body that isn't json, like an html 404 page, won't change.
+                return None
+            retry_after = response.headers.get('Retry-After')
+            error = f'HTTP {response.status}'
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+          error = repr(e)
+        if attempt >= self.max_retries:
+          print(f'Civitai request failed after {attempt + 1} attempts ({error}): {url}')
+          break
+        delay = min(60, 2**attempt) + random.random()
+        if retry_after is not None and retry_after.isdigit():
+          delay = max(delay, int(retry_after))
+        await asyncio.sleep(delay)
+    return None
+
+  async def close(self):
+    """Closes the shared session."""
+    if self.session is not None and not self.session.closed:
+      await self.session.close()
+
+
+_client = None
+
+
+def get_civitai_client() -> CivitaiClient:
+  """Returns the shared civitai client, configured from the `civitai` config."""
+  global _client
+  if _client is None:
+    max_retries = get_config_value('civitai.max_retries')
+    _client = CivitaiClient(
+      api_base=get_config_value('civitai.api_base') or 'https://civitai.com/api/v1',
+      concurrency=get_config_value('civitai.concurrency') or 4,
+      requests_per_second=get_config_value('civitai.requests_per_second') or 2.0,
+      max_retries=max_retries if max_retries is not None else 4,
+      timeout=get_config_value('civitai.timeout') or 30,
+    )
+  return _client
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ..utils import file_exists
+from .utils_info_store import get_all_file_hashes, save_file_hashes
+
+# Large buffers keep the number of read syscalls (and GIL round trips) low; hashlib releases the GIL
+# while digesting, so several threads can hash different files in parallel.
+HASH_BUFFER_SIZE = 1024 * 1024 * 8
+
+_hash_index = None
+# Index entries changed since the last save, by key.
+_unsaved_entries = {}
+_hash_index_lock = threading.RLock()
+
+
+def _get_hash_index() -> dict:
+  """Lazily loads the persisted hash index from the info store."""
+  global _hash_index
+  with _hash_index_lock:
+    if _hash_index is None:
+      _hash_index = get_all_file_hashes()
+    return _hash_index
+
+
+def _get_index_key(file_path: str):
+  return os.path.normcase(os.path.abspath(file_path))
+
+
+def _get_stat_key(file_path: str):
+  """Returns the (size, mtime_ns) pair used to validate an index entry."""
+  stat = os.stat(file_path)
+  return stat.st_size, stat.st_mtime_ns
+
+
+def save_hash_index():
+  """Writes the index entries changed since the last save to the info store, in one transaction."""
+  with _hash_index_lock:
+    if _unsaved_entries:
+      save_file_hashes(_unsaved_entries)
+      _unsaved_entries.clear()
+
+
+def get_indexed_sha256_hash(file_path: str):
+  """Returns the indexed hash for the file if it's still valid, without reading the file."""
+  if not file_path or not file_exists(file_path):
+    return None
+  size, mtime_ns = _get_stat_key(file_path)
+  with _hash_index_lock:
+    entry = _get_hash_index().get(_get_index_key(file_path))
+  if entry is not None and entry.get('size') == size and entry.get('mtime_ns') == mtime_ns:
+    return entry.get('sha256')
+  return None
+
+
+def set_indexed_sha256_hash(file_path: str, file_hash: str, stat_key=None, save=True):
+  """Stores a hash for the file, keyed by its current size and mtime.
+
+  With `save` false, the entry is written by the next `save_hash_index()`, so bulk hashing can
+  batch its writes.
+  """
+  size, mtime_ns = stat_key if stat_key is not None else _get_stat_key(file_path)
+  key = _get_index_key(file_path)
+  with _hash_index_lock:
+    _get_hash_index()[key] = _unsaved_entries[key] = {
+      'size': size,
+      'mtime_ns': mtime_ns,
+      'sha256': file_hash,
+    }
+    if save:
+      save_hash_index()
+
+
+def compute_sha256_hash(file_path: str, buffer: bytearray = None):
+  """Reads the entire file and returns its sha256 hash, bypassing the index.
+
+  The file is read with `readinto` into a single reusable buffer and digested through a memoryview,
+  so no intermediate bytes objects are created per chunk.
+  """
+  buffer = buffer if buffer is not None else bytearray(HASH_BUFFER_SIZE)
+  view = memoryview(buffer)
+  sha256_hash = hashlib.sha256()
+  with open(file_path, "rb", buffering=0) as f:
+    while True:
+      size = f.readinto(buffer)
+      if not size:
+        break
+      sha256_hash.update(view[:size])
+  return sha256_hash.hexdigest()
+
+
+def get_sha256_hash(file_path: str):
+  """Returns the hash for the file, only reading the file when the index entry is stale."""
+  if not file_path or not file_exists(file_path):
+    return None
+  file_hash = get_indexed_sha256_hash(file_path)
+  if file_hash is None:
+    # Grab the stat before hashing so a file modified mid-read is rehashed next time.
+    stat_key = _get_stat_key(file_path)
+    file_hash = compute_sha256_hash(file_path)
+    set_indexed_sha256_hash(file_path, file_hash, stat_key=stat_key)
+  return file_hash
+
+
+def hash_files(file_paths: list, max_workers=None, max_readers_per_disk=2, on_progress=None):
+  """Hashes many files in parallel, updating the hash index, and returns a dict of path to hash.
+
+  Files that already have a valid index entry are not read. Reading is spread over a thread pool,
+  but capped to `max_readers_per_disk` concurrent readers per device so spinning disks and network
+  mounts aren't thrashed by random access. `on_progress` is called with (done, total, file_path)
+  after each file completes, from a worker thread.
+  """
+  results = {}
+  to_hash = []
+  for file_path in file_paths:
+    file_hash = get_indexed_sha256_hash(file_path)
+    if file_hash is not None:
+      results[file_path] = file_hash
+    elif file_exists(file_path):
+      to_hash.append(file_path)
+
+  total = len(file_paths)
+  done = total - len(to_hash)
+  if on_progress is not None and done > 0:
+    on_progress(done, total, None)
+  if not to_hash:
+    return results
+
+  file_devices = {}
+  disk_semaphores = {}
+  for file_path in to_hash:
+    device = file_devices[file_path] = os.stat(file_path).st_dev
+    if device not in disk_semaphores:
+      disk_semaphores[device] = threading.BoundedSemaphore(max(1, max_readers_per_disk))
+
+  local = threading.local()
+
+  def hash_one(file_path):
+    if not hasattr(local, 'buffer'):
+      local.buffer = bytearray(HASH_BUFFER_SIZE)
+    stat_key = _get_stat_key(file_path)
+    with disk_semaphores[file_devices[file_path]]:
+      file_hash = compute_sha256_hash(file_path, buffer=local.buffer)
+    set_indexed_sha256_hash(file_path, file_hash, stat_key=stat_key, save=False)
+    return file_hash
+
+  if not max_workers:
+    max_workers = min(len(to_hash), len(disk_semaphores) * max(1, max_readers_per_disk))
+  with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='draekz_hash') as executor:
+    futures = {executor.submit(hash_one, file_path): file_path for file_path in to_hash}
+    for future in as_completed(futures):
+      file_path = futures[future]
+      try:
+        results[file_path] = future.result()
+      except OSError as e:
+        print(f'Could not hash {file_path}: {e}')
+      done += 1
+      if done % 50 == 0:
+        save_hash_index()
+      if on_progress is not None:
+        on_progress(done, total, file_path)
+
+  save_hash_index()
+  return results
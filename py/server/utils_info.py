@@ -2,58 +2,110 @@
 # See license details in the main LICENSE.rgthree file
 # https://github.com/rgthree/rgthree-comfy
 
-import hashlib
 import json
 import os
 import re
 from datetime import datetime
 
-import requests
-
 from server import PromptServer
 import folder_paths
 
 from ..utils import get_dict_value, load_json_file, file_exists, remove_path, save_json_file
-from ..utils_userdata import read_userdata_json, save_userdata_json, delete_userdata_file
+from ..utils_userdata import read_userdata_json, delete_userdata_file
+from .utils_hash import get_sha256_hash
+from .utils_server import run_blocking, run_hashing
+from .utils_civitai import get_civitai_client
+from . import utils_info_store as info_store
+from .utils_model_catalog import get_model_catalog
+from .utils_model_header import read_model_metadata, ModelHeaderError
+from ..config import get_config_value
 
 
 def _get_info_cache_file(data_type: str, file_hash: str):
   return f'info/{file_hash}.{data_type}.json'
 
 
+def _read_info_cache(file_hash: str, data_type: str):
+  """Reads a cached civitai/metadata response, importing a legacy userdata json if found."""
+  file_data = info_store.get_info_cache(file_hash, data_type)
+  if file_data is None:
+    file_data = read_userdata_json(_get_info_cache_file(file_hash, data_type))
+    if file_data is not None:
+      info_store.save_info_cache(file_hash, data_type, file_data)
+  return file_data
+
+
+def _delete_info_cache(file_hash: str, data_type: str):
+  """Deletes a cached civitai/metadata response, including any legacy userdata json."""
+  info_store.delete_info_cache(file_hash, data_type)
+  delete_userdata_file(_get_info_cache_file(file_hash, data_type))
+
+
 async def delete_model_info(
   file: str, model_type, del_info=True, del_metadata=True, del_civitai=True
 ):
   """Delete the info json, and the civitai & metadata caches."""
+  if del_civitai or del_metadata:
+    await _hash_model_file(file, model_type)
+  await run_blocking(
+    _delete_model_info,
+    file,
+    model_type,
+    del_info=del_info,
+    del_metadata=del_metadata,
+    del_civitai=del_civitai
+  )
+
+
+def _delete_model_info(file: str, model_type, del_info=True, del_metadata=True, del_civitai=True):
+  """Delete the info json, and the civitai & metadata caches. Blocking."""
   file_path = get_folder_path(file, model_type)
   if file_path is None:
     return
   if del_info:
+    info_store.delete_model_info_data(model_type, file)
     remove_path(get_info_file(file_path))
   if del_civitai or del_metadata:
     file_hash = _get_sha256_hash(file_path)
     if del_civitai:
-      json_file_path = _get_info_cache_file(file_hash, 'civitai')
-      delete_userdata_file(json_file_path)
+      _delete_info_cache(file_hash, 'civitai')
     if del_metadata:
-      json_file_path = _get_info_cache_file(file_hash, 'metadata')
-      delete_userdata_file(json_file_path)
+      _delete_info_cache(file_hash, 'metadata')
+  get_model_catalog(model_type).touch(file)
 
 
 def get_file_info(file: str, model_type):
-  """Gets basic file info, like created or modified date."""
+  """Gets basic file info, like created or modified date.
+
+  This is answered from the in-memory model catalog, falling back to the filesystem for files the
+  catalog doesn't know about (like those outside of the model folders).
+  """
+  file_info = get_model_catalog(model_type).get_file_info(file)
+  if file_info is not None:
+    return file_info
   file_path = get_folder_path(file, model_type)
   if file_path is None:
     return None
+  img_path = get_img_file(file_path)
   return {
     'file': file,
     'path': file_path,
     'modified': os.path.getmtime(file_path) * 1000,  # millis
-    'imageLocal': f'/draekz/api/{model_type}/img?file={file}' if get_img_file(file_path) else None,
+    'imageLocal': f'/draekz/api/{model_type}/img?file={file}' if img_path else None,
+    'imagePath': img_path,
     'hasInfoFile': get_info_file(file_path) is not None,
   }
 
 
+def get_files_info(files: list, model_type) -> list:
+  """Gets basic file info for many files at once."""
+  files_info = get_model_catalog(model_type).get_all_file_info(files)
+  return [
+    file_info if file_info is not None else get_file_info(file, model_type)
+    for file, file_info in zip(files, files_info)
+  ]
+
+
 def get_info_file(file_path: str, force=False):
   # Try to load a draekz-info.json file next to the file.
   info_path = f'{file_path}.draekz-info.json'
@@ -77,42 +129,66 @@ async def get_model_info(
   force_fetch_metadata=False,
   light=False
 ):
-  """Compiles a model info given a stored file next to the model, and/or metadata/civitai."""
+  """Compiles a model info given a stored file next to the model, and/or metadata/civitai.
+
+  The file work is run on the blocking executor, with the model hashed up front on the hashing
+  executor when it's needed, and civitai is fetched with the shared async client.
+  """
+  light = light and not maybe_fetch_civitai and not force_fetch_civitai
+  if not light and (maybe_fetch_metadata or force_fetch_metadata):
+    await _hash_model_file(file, model_type)
+  info_data, should_save, is_light = await run_blocking(
+    _load_model_info,
+    file,
+    model_type,
+    maybe_fetch_metadata=maybe_fetch_metadata,
+    force_fetch_metadata=force_fetch_metadata,
+    light=light
+  )
+  if info_data is None or is_light:
+    return info_data if info_data is not None else default
 
+  should_fetch_civitai = force_fetch_civitai is True or (
+    maybe_fetch_civitai is True and 'civitai' not in info_data['raw']
+  )
+  if should_fetch_civitai:
+    data_civitai = await _get_model_civitai_data(
+      file, model_type, default={}, refresh=force_fetch_civitai
+    )
+    should_save = _merge_civitai_data(info_data, data_civitai) or should_save
+
+  if 'sha256' not in info_data:
+    await _hash_model_file(file, model_type)
+  saved = await run_blocking(_finish_model_info, file, model_type, info_data, should_save)
+  if saved:
+    # If we're saving, then the UI is likely waiting to see if the refreshed data is coming in.
+    await PromptServer.instance.send(f"draekz-refreshed-{model_type}-info", {"data": info_data})
+
+  return info_data
+
+
+def _load_model_info(
+  file: str, model_type, maybe_fetch_metadata=False, force_fetch_metadata=False, light=False
+):
+  """Loads the stored model info, merging in file metadata when requested. Blocking.
+
+  Returns a tuple of the info data (or None if the file wasn't found), whether it needs saving, and
+  whether only light data was loaded (in which case nothing should be fetched or saved).
+  """
   file_path = get_folder_path(file, model_type)
   if file_path is None:
-    return default
+    return None, False, False
 
-  should_save = False
   # basic data
   basic_data = get_file_info(file, model_type)
-  # Try to load a draekz-info.json file next to the file.
-  info_data = load_json_file(get_info_file(file_path), default={})
-
-  for key in ['file', 'path', 'modified', 'imageLocal', 'hasInfoFile']:
-    if key in basic_data and basic_data[key] and (
-      key not in info_data or info_data[key] != basic_data[key]
-    ):
-      info_data[key] = basic_data[key]
-      should_save = True
+  info_data = _load_stored_model_info(file, model_type, file_path)
 
-  # Check if we have an image next to the file and, if so, add it to the front of the images
-  # (if it isn't already).
-  img_next_to_file = basic_data['imageLocal']
-
-  if 'images' not in info_data:
-    info_data['images'] = []
-    should_save = True
-
-  if img_next_to_file:
-    if len(info_data['images']) == 0 or info_data['images'][0]['url'] != img_next_to_file:
-      info_data['images'].insert(0, {'url': img_next_to_file})
-      should_save = True
+  should_save = _apply_file_info(info_data, basic_data)
 
   # If we just want light data then bail now with just existing data, plus file, path and img if
   # next to the file.
-  if light and not maybe_fetch_metadata and not force_fetch_metadata and not maybe_fetch_civitai and not force_fetch_civitai:
-    return info_data
+  if light and not maybe_fetch_metadata and not force_fetch_metadata:
+    return info_data, False, True
 
   if 'raw' not in info_data:
     info_data['raw'] = {}
@@ -120,9 +196,6 @@ async def get_model_info(
 
   should_save = _update_data(info_data) or should_save
 
-  should_fetch_civitai = force_fetch_civitai is True or (
-    maybe_fetch_civitai is True and 'civitai' not in info_data['raw']
-  )
   should_fetch_metadata = force_fetch_metadata is True or (
     maybe_fetch_metadata is True and 'metadata' not in info_data['raw']
   )
@@ -131,32 +204,81 @@ async def get_model_info(
     data_meta = _get_model_metadata(file, model_type, default={}, refresh=force_fetch_metadata)
     should_save = _merge_metadata(info_data, data_meta) or should_save
 
-  if should_fetch_civitai:
-    data_civitai = _get_model_civitai_data(
-      file, model_type, default={}, refresh=force_fetch_civitai
-    )
-    should_save = _merge_civitai_data(info_data, data_civitai) or should_save
+  return info_data, should_save, False
+
+
+def get_models_trained_words(files: list, model_type) -> dict:
+  """Returns a dict of file to its trained words sorted by count, or None if it has no info.
+
+  This is synchronous and only reads stored info (importing any draekz-info.json next to a model
+  not yet stored); it never hashes files or fetches from civitai.
+  """
+  result = info_store.get_trained_words(model_type, files)
+  for file in files:
+    if result.get(file) is None:
+      file_path = get_folder_path(file, model_type)
+      info_data = _load_stored_model_info(file, model_type, file_path) if file_path else None
+      result[file] = info_data.get('trainedWords') or [] if info_data else None
+  for file, words in result.items():
+    if words:
+      result[file] = _sort_trained_words(words)
+  return result
+
 
+def _sort_trained_words(words: list) -> list:
+  # Sort by count; if it doesn't exist, then assume it's a top item from civitai or elsewhere.
+  return sorted(words, key=lambda w: w['count'] if 'count' in w else 99999, reverse=True)
+
+
+def _finish_model_info(file: str, model_type, info_data: dict, should_save: bool) -> bool:
+  """Fills in the hash and saves the model info if anything changed. Blocking."""
   if 'sha256' not in info_data:
-    file_hash = _get_sha256_hash(file_path)
+    file_hash = _get_sha256_hash(get_folder_path(file, model_type))
     if file_hash is not None:
       info_data['sha256'] = file_hash
       should_save = True
 
   if should_save:
     if 'trainedWords' in info_data:
-      # Sort by count; if it doesn't exist, then assume it's a top item from civitai or elsewhere.
-      info_data['trainedWords'] = sorted(
-        info_data['trainedWords'],
-        key=lambda w: w['count'] if 'count' in w else 99999,
-        reverse=True
-      )
+      info_data['trainedWords'] = _sort_trained_words(info_data['trainedWords'])
     save_model_info(file, info_data, model_type)
 
-    # If we're saving, then the UI is likely waiting to see if the refreshed data is coming in.
-    await PromptServer.instance.send(f"draekz-refreshed-{model_type}-info", {"data": info_data})
+  return should_save
 
-  return info_data
+
+def _apply_file_info(info_data: dict, basic_data: dict) -> bool:
+  """Applies basic file info onto the info data. Returns true if anything changed."""
+  should_save = False
+  for key in ['file', 'path', 'modified', 'imageLocal', 'hasInfoFile']:
+    if key in basic_data and basic_data[key] and (
+      key not in info_data or info_data[key] != basic_data[key]
+    ):
+      info_data[key] = basic_data[key]
+      should_save = True
+
+  # Check if we have an image next to the file and, if so, add it to the front of the images
+  # (if it isn't already).
+  img_next_to_file = basic_data['imageLocal']
+
+  if 'images' not in info_data:
+    info_data['images'] = []
+    should_save = True
+
+  if img_next_to_file:
+    if len(info_data['images']) == 0 or info_data['images'][0]['url'] != img_next_to_file:
+      # The local image url is versioned by the image's mtime, so drop any older version of it.
+      local_url = _strip_image_version(img_next_to_file)
+      info_data['images'] = [
+        image for image in info_data['images']
+        if _strip_image_version(image.get('url') or '') != local_url
+      ]
+      info_data['images'].insert(0, {'url': img_next_to_file})
+      should_save = True
+  return should_save
+
+
+def _strip_image_version(url: str) -> str:
+  return url.split('&v=', 1)[0]
 
 
 def _update_data(info_data: dict) -> bool:
@@ -164,18 +286,13 @@ def _update_data(info_data: dict) -> bool:
   should_save = False
   # If we have "triggerWords" then move them over to "trainedWords"
   if 'triggerWords' in info_data and len(info_data['triggerWords']) > 0:
-    civitai_words = ','.join((
+    civitai_words = set(_split_civitai_words(
       get_dict_value(info_data, 'raw.civitai.triggerWords', default=[]) +
       get_dict_value(info_data, 'raw.civitai.trainedWords', default=[])
     ))
-    if 'trainedWords' not in info_data:
-      info_data['trainedWords'] = []
+    words_index = _index_trained_words(info_data)
     for trigger_word in info_data['triggerWords']:
-      word_data = next((data for data in info_data['trainedWords'] if data['word'] == trigger_word),
-                       None)
-      if word_data is None:
-        word_data = {'word': trigger_word}
-        info_data['trainedWords'].append(word_data)
+      word_data = _get_or_add_trained_word(info_data, words_index, trigger_word)
       if trigger_word in civitai_words:
         word_data['civitai'] = True
       else:
@@ -186,6 +303,36 @@ def _update_data(info_data: dict) -> bool:
   return should_save
 
 
+def _split_civitai_words(words: list) -> list:
+  """Splits civitai trigger/trained words, which may themselves be comma separated, into words."""
+  civitai_words = ','.join(words)
+  civitai_words = re.sub(r"\s*,\s*", ",", civitai_words)
+  civitai_words = re.sub(r",+", ",", civitai_words)
+  civitai_words = re.sub(r"^,", "", civitai_words)
+  civitai_words = re.sub(r",$", "", civitai_words)
+  return civitai_words.split(',') if civitai_words else []
+
+
+def _index_trained_words(info_data: dict) -> dict:
+  """Returns a dict of word to the first of its trainedWords entries, creating the list if needed."""
+  if 'trainedWords' not in info_data:
+    info_data['trainedWords'] = []
+  words_index = {}
+  for word_data in info_data['trainedWords']:
+    words_index.setdefault(word_data['word'], word_data)
+  return words_index
+
+
+def _get_or_add_trained_word(info_data: dict, words_index: dict, word: str) -> dict:
+  """Returns the trainedWords entry for a word, appending a new one if it doesn't exist."""
+  word_data = words_index.get(word)
+  if word_data is None:
+    word_data = {'word': word}
+    info_data['trainedWords'].append(word_data)
+    words_index[word] = word_data
+  return word_data
+
+
 def _merge_metadata(info_data: dict, data_meta: dict) -> bool:
   """Returns true if data was saved."""
   should_save = False
@@ -252,24 +399,11 @@ def _merge_civitai_data(info_data: dict, data_civitai: dict) -> bool:
   # We always want to merge triggerword.
   civitai_trigger = get_dict_value(data_civitai, 'triggerWords', default=[])
   civitai_trained = get_dict_value(data_civitai, 'trainedWords', default=[])
-  civitai_words = ','.join(civitai_trigger + civitai_trained)
+  civitai_words = _split_civitai_words(civitai_trigger + civitai_trained)
   if civitai_words:
-    civitai_words = re.sub(r"\s*,\s*", ",", civitai_words)
-    civitai_words = re.sub(r",+", ",", civitai_words)
-    civitai_words = re.sub(r"^,", "", civitai_words)
-    civitai_words = re.sub(r",$", "", civitai_words)
-    if civitai_words:
-      civitai_words = civitai_words.split(',')
-      if 'trainedWords' not in info_data:
-        info_data['trainedWords'] = []
-      for trigger_word in civitai_words:
-        word_data = next(
-          (data for data in info_data['trainedWords'] if data['word'] == trigger_word), None
-        )
-        if word_data is None:
-          word_data = {'word': trigger_word}
-          info_data['trainedWords'].append(word_data)
-        word_data['civitai'] = True
+    words_index = _index_trained_words(info_data)
+    for trigger_word in civitai_words:
+      _get_or_add_trained_word(info_data, words_index, trigger_word)['civitai'] = True
 
   if 'sha256' not in info_data:
     info_data['sha256'] = data_civitai['_sha256']
@@ -320,30 +454,20 @@ def _merge_civitai_data(info_data: dict, data_civitai: dict) -> bool:
   return should_save
 
 
-def _get_model_civitai_data(file: str, model_type, default=None, refresh=False):
+async def _get_model_civitai_data(file: str, model_type, default=None, refresh=False):
   """Gets the civitai data, either cached from the user directory, or from civitai api."""
-  file_hash = _get_sha256_hash(get_folder_path(file, model_type))
+  file_hash = await _hash_model_file(file, model_type)
   if file_hash is None:
     return None
 
-  json_file_path = _get_info_cache_file(file_hash, 'civitai')
-
-  api_url = f'https://civitai.com/api/v1/model-versions/by-hash/{file_hash}'
-  file_data = read_userdata_json(json_file_path)
+  client = get_civitai_client()
+  api_url = client.get_model_version_by_hash_url(file_hash)
+  file_data = await run_blocking(_read_info_cache, file_hash, 'civitai')
   if file_data is None or refresh is True:
-    try:
-      response = requests.get(api_url, timeout=5000)
-      data = response.json()
-      save_userdata_json(
-        json_file_path, {
-          'url': api_url,
-          'timestamp': datetime.now().timestamp(),
-          'response': data
-        }
-      )
-      file_data = read_userdata_json(json_file_path)
-    except requests.exceptions.RequestException as e:  # This is the correct syntax
-      print(e)
+    data = await client.get_model_version_by_hash(file_hash)
+    if data is not None:
+      file_data = {'url': api_url, 'timestamp': datetime.now().timestamp(), 'response': data}
+      await run_blocking(info_store.save_info_cache, file_hash, 'civitai', file_data)
   response = file_data['response'] if file_data is not None and 'response' in file_data else None
   if response is not None:
     response['_sha256'] = file_hash
@@ -358,14 +482,12 @@ def _get_model_metadata(file: str, model_type, default=None, refresh=False):
   if file_hash is None:
     return default
 
-  json_file_path = _get_info_cache_file(file_hash, 'metadata')
-
-  file_data = read_userdata_json(json_file_path)
+  file_data = _read_info_cache(file_hash, 'metadata')
   if file_data is None or refresh is True:
     data = _read_file_metadata_from_header(file_path)
     if data is not None:
       file_data = {'url': file, 'timestamp': datetime.now().timestamp(), 'response': data}
-      save_userdata_json(json_file_path, file_data)
+      info_store.save_info_cache(file_hash, 'metadata', file_data)
   response = file_data['response'] if file_data is not None and 'response' in file_data else None
   if response is not None:
     response['_sha256'] = file_hash
@@ -374,37 +496,11 @@ def _get_model_metadata(file: str, model_type, default=None, refresh=False):
 
 def _read_file_metadata_from_header(file_path: str) -> dict:
   """Reads the file's header and returns a JSON dict metdata if available."""
-  data = None
   try:
-    if file_path.endswith('.safetensors'):
-      with open(file_path, "rb") as file:
-        # https://github.com/huggingface/safetensors#format
-        # 8 bytes: N, an unsigned little-endian 64-bit integer, containing the size of the header
-        header_size = int.from_bytes(file.read(8), "little", signed=False)
-
-        if header_size <= 0:
-          raise BufferError("Invalid header size")
-
-        header = file.read(header_size)
-        if header is None:
-          raise BufferError("Invalid header")
-
-        header_json = json.loads(header)
-        data = header_json["__metadata__"] if "__metadata__" in header_json else None
-
-        if data is not None:
-          for key, value in data.items():
-            if isinstance(value, str) and value.startswith('{') and value.endswith('}'):
-              try:
-                value_as_json = json.loads(value)
-                data[key] = value_as_json
-              except Exception:
-                print(f'metdata for field {key} did not parse as json')
-  except requests.exceptions.RequestException as e:
-    print(e)
-    data = None
-
-  return data
+    return read_model_metadata(file_path)
+  except (OSError, ModelHeaderError) as e:
+    print(f'Could not read metadata from {file_path}: {e}')
+  return None
 
 
 def get_folder_path(file: str, model_type):
@@ -418,31 +514,83 @@ def get_folder_path(file: str, model_type):
 
 
 def _get_sha256_hash(file_path: str):
-  """Returns the hash for the file."""
-  if not file_path or not file_exists(file_path):
-    return None
-  BUF_SIZE = 1024 * 128  # lets read stuff in 64kb chunks!
-  file_hash = None
-  sha256_hash = hashlib.sha256()
-  with open(file_path, "rb") as f:
-    # Read and update hash string value in blocks of BUF_SIZE
-    for byte_block in iter(lambda: f.read(BUF_SIZE), b""):
-      sha256_hash.update(byte_block)
-    file_hash = sha256_hash.hexdigest()
-  return file_hash
+  """Returns the hash for the file, served from the persisted hash index when still valid."""
+  return get_sha256_hash(file_path)
+
+
+async def _hash_model_file(file: str, model_type):
+  """Hashes a model on the hashing executor, so later lookups on the blocking one hit the index."""
+  return await run_hashing(lambda: _get_sha256_hash(get_folder_path(file, model_type)))
 
 
 async def set_model_info_partial(file: str, model_type: str, info_data_partial):
   """Sets partial data into the existing model info data."""
   info_data = await get_model_info(file, model_type, default={})
   info_data = {**info_data, **info_data_partial}
-  save_model_info(file, info_data, model_type)
+  await run_blocking(save_model_info, file, info_data, model_type)
 
 
 def save_model_info(file: str, info_data, model_type):
-  """Saves the model info alongside the model itself."""
+  """Saves the model info to the store and, unless disabled, to a json file next to the model."""
   file_path = get_folder_path(file, model_type)
   if file_path is None:
     return
-  info_path = get_info_file(file_path, force=True)
-  save_json_file(info_path, info_data)
+  info_store.save_model_info_data(model_type, file, info_data)
+  if get_config_value('model_info.write_sidecars') is not False:
+    save_json_file(get_info_file(file_path, force=True), info_data)
+  get_model_catalog(model_type).touch(file)
+
+
+def _load_stored_model_info(file: str, model_type, file_path: str) -> dict:
+  """Loads the stored model info, importing a draekz-info.json next to the file if not stored."""
+  info_data = info_store.get_model_info_data(model_type, file)
+  if info_data is None:
+    info_data = load_json_file(get_info_file(file_path), default={})
+    if info_data:
+      info_store.save_model_info_data(model_type, file, info_data)
+  return info_data
+
+
+def import_model_info(file: str, model_type) -> bool:
+  """Imports the draekz-info.json next to a model into the store, replacing what's stored."""
+  file_path = get_folder_path(file, model_type)
+  info_data = load_json_file(get_info_file(file_path), default=None) if file_path else None
+  if not info_data:
+    return False
+  info_store.save_model_info_data(model_type, file, info_data)
+  get_model_catalog(model_type).touch(file)
+  return True
+
+
+def export_model_info(file: str, model_type) -> bool:
+  """Exports the stored info for a model to a draekz-info.json next to it."""
+  file_path = get_folder_path(file, model_type)
+  info_data = info_store.get_model_info_data(model_type, file) if file_path else None
+  if info_data is None:
+    return False
+  save_json_file(get_info_file(file_path, force=True), info_data)
+  return True
+
+
+def get_models_info_light(files: list, model_type, all_files=False) -> list:
+  """Returns light model info for many files, reading stored info in as few queries as possible.
+
+  This matches `get_model_info(light=True)` for each file, without per-file store lookups. Pass
+  `all_files` when `files` is the whole folder, to read every stored model at once. Blocking.
+  """
+  if all_files:
+    stored = info_store.get_all_model_info_data(model_type)
+  else:
+    stored = info_store.get_model_info_data_for_files(model_type, files)
+  result = []
+  for file, basic_data in zip(files, get_files_info(files, model_type)):
+    if file not in stored:
+      info_data, _, _ = _load_model_info(file, model_type, light=True)
+      result.append(info_data)
+      continue
+    if basic_data is None:
+      result.append(None)
+      continue
+    _apply_file_info(stored[file], basic_data)
+    result.append(stored[file])
+  return result
@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ..utils_userdata import clean_path
+
+_DB_FILE = 'model_info.db'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS model_info (
+  model_type TEXT NOT NULL,
+  file TEXT NOT NULL,
+  sha256 TEXT,
+  data TEXT NOT NULL,
+  updated REAL NOT NULL,
+  PRIMARY KEY (model_type, file)
+);
+CREATE INDEX IF NOT EXISTS model_info_sha256 ON model_info (sha256);
+CREATE TABLE IF NOT EXISTS trained_words (
+  model_type TEXT NOT NULL,
+  file TEXT NOT NULL,
+  position INTEGER NOT NULL,
+  word TEXT NOT NULL,
+  count INTEGER,
+  PRIMARY KEY (model_type, file, position)
+);
+CREATE TABLE IF NOT EXISTS info_cache (
+  sha256 TEXT NOT NULL,
+  data_type TEXT NOT NULL,
+  url TEXT,
+  timestamp REAL,
+  response TEXT,
+  PRIMARY KEY (sha256, data_type)
+);
+CREATE TABLE IF NOT EXISTS file_hashes (
+  path TEXT PRIMARY KEY,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  sha256 TEXT NOT NULL
+);
+'''
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+# SQLite limits the number of bound parameters, so large `IN` lookups are split up.
+_MAX_QUERY_PARAMS = 500
+
+# An in-memory index of (model_type, file) to trained words, filled from the store on lookup and
+# invalidated whenever a model's info is saved or deleted. None means there's no stored info.
+_trained_words = {}
+# A generation per (model_type, file), bumped on each invalidation, so a lookup that raced a save
+# doesn't put the words it read before the save into the index.
+_trained_words_generations = {}
+_trained_words_lock = threading.Lock()
+
+
+def _get_connection() -> sqlite3.Connection:
+  """Returns this thread's connection to the store, creating the database if needed."""
+  global _schema_ready
+  conn = getattr(_local, 'conn', None)
+  if conn is None:
+    path = clean_path(_DB_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _schema_lock:
+      if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    _local.conn = conn
+  return conn
+
+
+def get_model_info_data(model_type: str, file: str):
+  """Returns the stored info data for a model file, or None."""
+  row = _get_connection().execute(
+    'SELECT data FROM model_info WHERE model_type = ? AND file = ?', (model_type, file)
+  ).fetchone()
+  return json.loads(row[0]) if row is not None else None
+
+
+def get_all_model_info_data(model_type: str) -> dict:
+  """Returns a dict of file to stored info data for every stored model of a type, in one query."""
+  rows = _get_connection().execute(
+    'SELECT file, data FROM model_info WHERE model_type = ?', (model_type,)
+  )
+  return {file: json.loads(data) for file, data in rows}
+
+
+def get_model_info_data_for_files(model_type: str, files: list) -> dict:
+  """Returns a dict of file to stored info data for the given files that are stored."""
+  conn = _get_connection()
+  result = {}
+  for i in range(0, len(files), _MAX_QUERY_PARAMS):
+    chunk = files[i:i + _MAX_QUERY_PARAMS]
+    rows = conn.execute(
+      'SELECT file, data FROM model_info '
+      f'WHERE model_type = ? AND file IN ({", ".join("?" * len(chunk))})', (model_type, *chunk)
+    )
+    result.update((file, json.loads(data)) for file, data in rows)
+  return result
+
+
+def get_trained_words(model_type: str, files: list) -> dict:
+  """Returns a dict of file to its stored trained words, or None for files without stored info.
+
+  Words are dicts of `word` and `count`, in their stored order. Files not in the in-memory index
+  are read from the store in as few queries as possible.
+  """
+  result = {}
+  missing = []
+  generations = {}
+  with _trained_words_lock:
+    for file in files:
+      key = (model_type, file)
+      if key in _trained_words:
+        result[file] = _trained_words[key]
+      elif file not in generations:
+        missing.append(file)
+        generations[file] = _trained_words_generations.get(key, 0)
+
+  conn = _get_connection()
+  for i in range(0, len(missing), _MAX_QUERY_PARAMS):
+    chunk = missing[i:i + _MAX_QUERY_PARAMS]
+    found = {}
+    rows = conn.execute(
+      'SELECT m.file, t.word, t.count FROM model_info m LEFT JOIN trained_words t '
+      'ON t.model_type = m.model_type AND t.file = m.file '
+      f'WHERE m.model_type = ? AND m.file IN ({", ".join("?" * len(chunk))}) '
+      'ORDER BY m.file, t.position', (model_type, *chunk)
+    )
+    for file, word, count in rows:
+      words = found.setdefault(file, [])
+      if word is not None:
+        words.append({'word': word, 'count': count} if count is not None else {'word': word})
+    with _trained_words_lock:
+      for file in chunk:
+        words = found.get(file)
+        key = (model_type, file)
+        if _trained_words_generations.get(key, 0) == generations[file]:
+          _trained_words[key] = words
+        result[file] = words
+  return result
+
+
+def _invalidate_trained_words(model_type: str, file: str):
+  """Drops a model's indexed trained words. Called once a change to them is committed."""
+  key = (model_type, file)
+  with _trained_words_lock:
+    _trained_words.pop(key, None)
+    _trained_words_generations[key] = _trained_words_generations.get(key, 0) + 1
+
+
+def save_model_info_data(model_type: str, file: str, data: dict):
+  """Stores the info data for a model file, along with its trained words."""
+  conn = _get_connection()
+  with conn:
+    conn.execute(
+      'INSERT OR REPLACE INTO model_info (model_type, file, sha256, data, updated) '
+      'VALUES (?, ?, ?, ?, ?)',
+      (model_type, file, data.get('sha256'), json.dumps(data), time.time())
+    )
+    conn.execute(
+      'DELETE FROM trained_words WHERE model_type = ? AND file = ?', (model_type, file)
+    )
+    conn.executemany(
+      'INSERT INTO trained_words (model_type, file, position, word, count) VALUES (?, ?, ?, ?, ?)',
+      [(model_type, file, position, word_data['word'], word_data.get('count'))
+       for position, word_data in enumerate(data.get('trainedWords') or [])
+       if word_data and word_data.get('word')]
+    )
+  _invalidate_trained_words(model_type, file)
+
+
+def delete_model_info_data(model_type: str, file: str):
+  """Removes the stored info data for a model file."""
+  conn = _get_connection()
+  with conn:
+    conn.execute('DELETE FROM model_info WHERE model_type = ? AND file = ?', (model_type, file))
+    conn.execute(
+      'DELETE FROM trained_words WHERE model_type = ? AND file = ?', (model_type, file)
+    )
+  _invalidate_trained_words(model_type, file)
+
+
+def get_info_cache(file_hash: str, data_type: str):
+  """Returns a cached civitai/metadata response as {url, timestamp, response}, or None."""
+  row = _get_connection().execute(
+    'SELECT url, timestamp, response FROM info_cache WHERE sha256 = ? AND data_type = ?',
+    (file_hash, data_type)
+  ).fetchone()
+  if row is None:
+    return None
+  return {'url': row[0], 'timestamp': row[1], 'response': json.loads(row[2])}
+
+
+def save_info_cache(file_hash: str, data_type: str, data: dict):
+  """Stores a civitai/metadata response given as {url, timestamp, response}."""
+  conn = _get_connection()
+  with conn:
+    conn.execute(
+      'INSERT OR REPLACE INTO info_cache (sha256, data_type, url, timestamp, response) '
+      'VALUES (?, ?, ?, ?, ?)',
+      (
+        file_hash, data_type, data.get('url'), data.get('timestamp'),
+        json.dumps(data.get('response'))
+      )
+    )
+
+
+def delete_info_cache(file_hash: str, data_type: str):
+  """Removes a cached civitai/metadata response."""
+  conn = _get_connection()
+  with conn:
+    conn.execute(
+      'DELETE FROM info_cache WHERE sha256 = ? AND data_type = ?', (file_hash, data_type)
+    )
+
+
+def get_all_file_hashes() -> dict:
+  """Returns a dict of path to {size, mtime_ns, sha256} for every stored file hash."""
+  rows = _get_connection().execute('SELECT path, size, mtime_ns, sha256 FROM file_hashes')
+  return {
+    path: {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256}
+    for path, size, mtime_ns, sha256 in rows
+  }
+
+
+def save_file_hashes(entries: dict):
+  """Stores file hashes given as a dict of path to {size, mtime_ns, sha256}, in one transaction."""
+  conn = _get_connection()
+  with conn:
+    conn.executemany(
+      'INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)',
+      [(path, entry['size'], entry['mtime_ns'], entry['sha256']) for path, entry in entries.items()]
+    )
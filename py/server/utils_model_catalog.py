@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+import uuid
+
+import folder_paths
+
+_IMAGE_EXTENSIONS = ['jpg', 'png', 'jpeg', 'webp']
+_EXCLUDED_DIR_NAMES = {'.git'}
+
+# Versions restart on every server start, so version tokens handed to clients are prefixed with an
+# id for this process; a token from a previous run is then never mistaken for a current version.
+CATALOG_ID = uuid.uuid4().hex[:8]
+
+
+class ModelCatalog:
+  """A resident catalog of basic file info for one model type.
+
+  The catalog is built with a single scandir pass over the model folders, which also tells us about
+  preview images and info files next to each model without probing for them. Afterwards, refreshes
+  only stat each known directory and rescan those whose mtime changed, so a request costs one stat
+  per directory rather than several per model. Refreshes are throttled to `min_refresh_interval`.
+
+  Every change to an entry bumps the catalog `version`, and entries remember the version they last
+  changed at, so clients can cheaply ask what changed since a version they've seen.
+
+  Note: a model overwritten in place doesn't change its directory's mtime and so won't be noticed
+  until something else in that directory changes, or `touch` is called for it.
+  """
+
+  def __init__(self, model_type: str, min_refresh_interval=1.0):
+    self.model_type = model_type
+    self.min_refresh_interval = min_refresh_interval
+    self.version = 0
+    self.lock = threading.RLock()
+    self.entries = {}
+    self.entry_versions = {}
+    self.removed_versions = {}
+    self.base_dirs = []
+    self.dir_mtimes = {}
+    self.dir_files = {}
+    self.last_refresh = 0
+
+  def refresh(self, force=False):
+    """Rescans any model directories that changed since the last refresh."""
+    with self.lock:
+      now = time.monotonic()
+      if not force and now - self.last_refresh < self.min_refresh_interval:
+        return
+      self.last_refresh = now
+
+      base_dirs = [os.path.abspath(d) for d in folder_paths.get_folder_paths(self.model_type)]
+      extensions = folder_paths.folder_names_and_paths[self.model_type][1]
+      changed = base_dirs != self.base_dirs
+      self.base_dirs = base_dirs
+
+      known_dirs = set(self.dir_mtimes.keys())
+      seen_dirs = set()
+      to_scan = []
+      for base_dir in base_dirs:
+        to_scan.append((base_dir, base_dir))
+      while to_scan:
+        dir_path, base_dir = to_scan.pop()
+        if dir_path in seen_dirs:
+          continue
+        seen_dirs.add(dir_path)
+        try:
+          mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+          continue
+        if self.dir_mtimes.get(dir_path) != mtime or dir_path not in self.dir_files:
+          self.dir_mtimes[dir_path] = mtime
+          self.dir_files[dir_path] = self._scan_dir(dir_path, base_dir, extensions)
+          changed = True
+        to_scan.extend((sub_dir, base_dir) for sub_dir in self.dir_files[dir_path]['dirs'])
+
+      for dir_path in known_dirs - seen_dirs:
+        del self.dir_mtimes[dir_path]
+        self.dir_files.pop(dir_path, None)
+        changed = True
+
+      if changed:
+        self._rebuild_entries()
+
+  def _scan_dir(self, dir_path: str, base_dir: str, extensions):
+    """Lists a single directory, returning its sub directories and model file infos."""
+    dirs = []
+    names = {}
+    try:
+      with os.scandir(dir_path) as it:
+        for entry in it:
+          try:
+            if entry.is_dir():
+              if entry.name not in _EXCLUDED_DIR_NAMES:
+                dirs.append(entry.path)
+            else:
+              names[entry.name] = entry
+          except OSError:
+            continue
+    except OSError:
+      pass
+
+    # Preview images and info files are matched ignoring case, like lookups on Windows and macOS.
+    lower_names = {name.lower(): entry for name, entry in names.items()}
+    files = {}
+    for name, entry in names.items():
+      stem, ext = os.path.splitext(name)
+      if extensions and ext.lower() not in extensions:
+        continue
+      try:
+        modified = entry.stat().st_mtime * 1000  # millis
+      except OSError:
+        continue
+      file = os.path.relpath(entry.path, base_dir)
+      image = self._find_image(stem, lower_names)
+      files[file] = {
+        'file': file,
+        'path': entry.path,
+        'modified': modified,
+        'imageLocal': self._get_image_url(file, image) if image is not None else None,
+        'imagePath': image.path if image is not None else None,
+        'hasInfoFile': f'{name}.draekz-info.json'.lower() in lower_names,
+      }
+    return {'base_dir': base_dir, 'dirs': dirs, 'files': files}
+
+  @staticmethod
+  def _find_image(stem: str, lower_names: dict):
+    """Returns the dir entry of a model's preview image, by lowercased name, or None."""
+    for img_ext in _IMAGE_EXTENSIONS:
+      image = lower_names.get(f'{stem}.{img_ext}'.lower())
+      if image is not None:
+        return image
+    return None
+
+  def _get_image_url(self, file: str, image) -> str:
+    """Returns a model's image url, versioned by the image's mtime so a changed image gets a new url."""
+    try:
+      version = image.stat().st_mtime_ns
+    except OSError:
+      version = 0
+    return f'/draekz/api/{self.model_type}/img?file={file}&v={version}'
+
+  def _rebuild_entries(self):
+    """Merges directory listings into entries, bumping versions for anything that changed."""
+    entries = {}
+    # Earlier base dirs win, matching how folder_paths resolves a file.
+    for base_dir in reversed(self.base_dirs):
+      for listing in self.dir_files.values():
+        if listing['base_dir'] == base_dir:
+          entries.update(listing['files'])
+
+    version = self.version + 1
+    bumped = False
+    for file, info in entries.items():
+      if self.entries.get(file) != info:
+        self.entry_versions[file] = version
+        self.removed_versions.pop(file, None)
+        bumped = True
+    for file in self.entries.keys() - entries.keys():
+      self.entry_versions.pop(file, None)
+      self.removed_versions[file] = version
+      bumped = True
+    self.entries = entries
+    if bumped:
+      self.version = version
+
+  def touch(self, file: str):
+    """Marks a file as changed, e.g. after its stored info changed.
+
+    Its directory is rescanned on the next refresh, to pick up any new info or image files.
+    """
+    with self.lock:
+      info = self.entries.get(file)
+      if info is not None:
+        self.dir_mtimes.pop(os.path.dirname(info['path']), None)
+        self.version += 1
+        self.entry_versions[file] = self.version
+      return self.version
+
+  def get_version(self):
+    """Returns the current catalog version."""
+    self.refresh()
+    return self.version
+
+  def get_files(self) -> list:
+    """Returns the sorted list of catalogued files."""
+    self.refresh()
+    with self.lock:
+      return sorted(self.entries.keys())
+
+  def get_file_info(self, file: str):
+    """Returns a copy of the basic file info for a file, or None if it's not catalogued."""
+    self.refresh()
+    with self.lock:
+      info = self.entries.get(file)
+      return dict(info) if info is not None else None
+
+  def get_all_file_info(self, files=None) -> list:
+    """Returns basic file info for the provided files (or all files), None for unknown files."""
+    self.refresh()
+    with self.lock:
+      files = files if files is not None else sorted(self.entries.keys())
+      return [dict(self.entries[f]) if f in self.entries else None for f in files]
+
+  def changed_since(self, version: int):
+    """Returns the current version, and the files changed and removed since the given version."""
+    self.refresh()
+    with self.lock:
+      changed = sorted(f for f, v in self.entry_versions.items() if v > version)
+      removed = sorted(f for f, v in self.removed_versions.items() if v > version)
+      return self.version, changed, removed
+
+
+def get_version_token(version: int) -> str:
+  """Returns the client facing token for a catalog version."""
+  return f'{CATALOG_ID}-{version}'
+
+
+def parse_version_token(token: str):
+  """Returns the catalog version from a client token, or None if invalid or from another run."""
+  if not token or '-' not in token:
+    return None
+  catalog_id, version = token.rsplit('-', 1)
+  if catalog_id != CATALOG_ID or not version.isdigit():
+    return None
+  return int(version)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_model_catalog(model_type: str) -> ModelCatalog:
+  """Returns the shared catalog for a model type."""
+  with _catalogs_lock:
+    if model_type not in _catalogs:
+      _catalogs[model_type] = ModelCatalog(model_type)
+    return _catalogs[model_type]
@@ -0,0 +1,192 @@
+import json
+import mmap
+import os
+import struct
+
+# The safetensors spec caps headers at 100MB; anything larger is corrupt or not a safetensors file.
+SAFETENSORS_MAX_HEADER_SIZE = 1024 * 1024 * 100
+
+# GGUF arrays (like a tokenizer's vocabulary) can hold hundreds of thousands of items. Those larger
+# than this are skipped over and summarized rather than returned.
+GGUF_MAX_ARRAY_ITEMS = 1024
+GGUF_MAX_STRING_SIZE = 1024 * 1024 * 16
+
+_GGUF_MAGIC = b'GGUF'
+# GGUF value type to struct format for fixed size values.
+_GGUF_SCALAR_FORMATS = {
+  0: '<B',
+  1: '<b',
+  2: '<H',
+  3: '<h',
+  4: '<I',
+  5: '<i',
+  6: '<f',
+  7: '<?',
+  10: '<Q',
+  11: '<q',
+  12: '<d',
+}
+_GGUF_TYPE_STRING = 8
+_GGUF_TYPE_ARRAY = 9
+
+
+class ModelHeaderError(ValueError):
+  """Raised when a model file's header is invalid or exceeds our limits."""
+
+
+def read_model_metadata(file_path: str):
+  """Reads the metadata from a model file's header, if it's a supported format.
+
+  Only the header is touched, through a memory map, so this stays cheap for multi-GB files. Returns
+  None for unsupported files or files without metadata.
+  """
+  if file_path.endswith('.safetensors'):
+    return read_safetensors_metadata(file_path)
+  if file_path.endswith('.gguf'):
+    return read_gguf_metadata(file_path)
+  return None
+
+
+def _map_file(file):
+  return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_safetensors_metadata(file_path: str, max_header_size=SAFETENSORS_MAX_HEADER_SIZE):
+  """Reads the `__metadata__` of a safetensors file.
+
+  String values that look like json objects (like kohya's `ss_tag_frequency`) are decoded. The
+  header's tensor index isn't parsed unless the metadata can't be found on its own.
+  """
+  # https://github.com/huggingface/safetensors#format
+  # 8 bytes: N, an unsigned little-endian 64-bit integer, containing the size of the header
+  if os.path.getsize(file_path) < 8:
+    raise ModelHeaderError('File too small to be a safetensors file')
+  with open(file_path, 'rb') as file, _map_file(file) as mapped:
+    header_size = struct.unpack_from('<Q', mapped, 0)[0]
+    if header_size <= 0 or header_size > max_header_size or header_size + 8 > len(mapped):
+      raise ModelHeaderError(f'Invalid header size {header_size}')
+    header = mapped[8:8 + header_size]
+
+  data = _find_safetensors_metadata(header)
+  if not isinstance(data, dict):
+    return None
+
+  for key, value in data.items():
+    if isinstance(value, str) and value.startswith('{') and value.endswith('}'):
+      try:
+        data[key] = json.loads(value)
+      except json.decoder.JSONDecodeError:
+        print(f'metdata for field {key} did not parse as json')
+  return data
+
+
+def _find_safetensors_metadata(header: bytes):
+  """Decodes just the `__metadata__` object from a safetensors header.
+
+  Checkpoint headers are mostly a large tensor index we don't need, so we decode only the metadata
+  object when we can find it, falling back to parsing the whole header.
+  """
+  index = header.find(b'"__metadata__"')
+  if index != -1:
+    colon = header.find(b':', index + len(b'"__metadata__"'))
+    if colon != -1:
+      try:
+        text = header[colon + 1:].decode('utf-8').lstrip()
+        value, _ = json.JSONDecoder().raw_decode(text)
+        if isinstance(value, dict):
+          return value
+      except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+        pass
+  try:
+    header_json = json.loads(header)
+  except (UnicodeDecodeError, json.decoder.JSONDecodeError) as e:
+    raise ModelHeaderError(f'Invalid header: {e}') from e
+  return header_json.get('__metadata__') if isinstance(header_json, dict) else None
+
+
+def read_gguf_metadata(file_path: str, max_array_items=GGUF_MAX_ARRAY_ITEMS):
+  """Reads the key/value metadata of a GGUF file.
+
+  Arrays larger than `max_array_items` are returned as a `{'type': 'array', 'length': n}` summary.
+  """
+  # https://github.com/ggerganov/ggml/blob/master/docs/gguf.md
+  if os.path.getsize(file_path) < 24:
+    raise ModelHeaderError('File too small to be a GGUF file')
+  with open(file_path, 'rb') as file, _map_file(file) as mapped:
+    if mapped[:4] != _GGUF_MAGIC:
+      raise ModelHeaderError('Not a GGUF file')
+    reader = _GgufReader(mapped, max_array_items)
+    version = reader.read('<I')
+    if version == 1:
+      # Version 1 used 32-bit counts and lengths.
+      reader.size_format = '<I'
+    reader.read(reader.size_format)  # tensor count
+    kv_count = reader.read(reader.size_format)
+    data = {}
+    for _ in range(kv_count):
+      key = reader.read_string()
+      value_type = reader.read('<I')
+      data[key] = reader.read_value(value_type)
+  return data
+
+
+class _GgufReader:
+  """Sequentially reads GGUF values from a buffer."""
+
+  def __init__(self, buffer, max_array_items):
+    self.buffer = buffer
+    self.offset = 4
+    self.size_format = '<Q'
+    self.max_array_items = max_array_items
+
+  def read(self, fmt: str):
+    try:
+      value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+    except struct.error as e:
+      raise ModelHeaderError('Unexpected end of GGUF header') from e
+    self.offset += struct.calcsize(fmt)
+    return value
+
+  def read_string(self):
+    size = self.read(self.size_format)
+    if size > GGUF_MAX_STRING_SIZE or self.offset + size > len(self.buffer):
+      raise ModelHeaderError(f'Invalid GGUF string size {size}')
+    value = self.buffer[self.offset:self.offset + size].decode('utf-8', errors='replace')
+    self.offset += size
+    return value
+
+  def read_value(self, value_type: int):
+    if value_type in _GGUF_SCALAR_FORMATS:
+      return self.read(_GGUF_SCALAR_FORMATS[value_type])
+    if value_type == _GGUF_TYPE_STRING:
+      return self.read_string()
+    if value_type == _GGUF_TYPE_ARRAY:
+      item_type = self.read('<I')
+      length = self.read(self.size_format)
+      if length > self.max_array_items:
+        self._skip_items(item_type, length)
+        return {'type': 'array', 'length': length}
+      return [self.read_value(item_type) for _ in range(length)]
+    raise ModelHeaderError(f'Unknown GGUF value type {value_type}')
+
+  def skip_value(self, value_type: int):
+    if value_type == _GGUF_TYPE_ARRAY:
+      item_type = self.read('<I')
+      self._skip_items(item_type, self.read(self.size_format))
+    else:
+      self._skip_items(value_type, 1)
+
+  def _skip_items(self, item_type: int, length: int):
+    if item_type in _GGUF_SCALAR_FORMATS:
+      self.offset += struct.calcsize(_GGUF_SCALAR_FORMATS[item_type]) * length
+    elif item_type == _GGUF_TYPE_STRING:
+      for _ in range(length):
+        size = self.read(self.size_format)
+        self.offset += size
+    elif item_type == _GGUF_TYPE_ARRAY:
+      for _ in range(length):
+        self.skip_value(item_type)
+    else:
+      raise ModelHeaderError(f'Unknown GGUF value type {item_type}')
+    if self.offset > len(self.buffer):
+      raise ModelHeaderError('Unexpected end of GGUF header')
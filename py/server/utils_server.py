@@ -2,18 +2,56 @@
 # See license details in the main LICENSE.rgthree file
 # https://github.com/rgthree/rgthree-comfy
 
+import asyncio
+import functools
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 from aiohttp import web
 
+from ..config import get_config_value
+
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 DIR_WEB = os.path.abspath(f'{THIS_DIR}/../../web/')
 
+# A bounded pool for blocking file, hashing and network work done on behalf of route handlers, so
+# the aiohttp event loop (and ComfyUI's websocket progress) is never stalled by it.
+_BLOCKING_EXECUTOR = ThreadPoolExecutor(
+  max_workers=get_config_value('server.blocking_workers') or 4, thread_name_prefix='draekz_server'
+)
+
+# Cold hashes of multi-GB models can take minutes, so they get their own pool and list and detail
+# lookups on the blocking executor don't queue behind them.
+_HASH_EXECUTOR = ThreadPoolExecutor(
+  max_workers=get_config_value('server.hash_workers') or 2, thread_name_prefix='draekz_hash'
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+  """Runs a blocking function on the bounded server executor and awaits its result."""
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(_BLOCKING_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+async def run_hashing(func, *args, **kwargs):
+  """Runs a function that may hash model files on the hashing executor and awaits its result."""
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(_HASH_EXECUTOR, functools.partial(func, *args, **kwargs))
+
 
 def get_param(request, param, default=None):
   """Gets a param from a request."""
   return request.rel_url.query[param] if param in request.rel_url.query else default
 
 
+def get_int_param(request, param, default: int, min_value: int, max_value: int):
+  """Gets an int param from a request, clamped to a range. Raises ValueError if it's not an int."""
+  val = get_param(request, param)
+  if val is None:
+    return default
+  return max(min_value, min(max_value, int(val)))
+
+
 def is_param_falsy(request, param):
   """Determines if a param is explicitly 0 or false."""
   val = get_param(request, param)
@@ -26,6 +64,20 @@ def is_param_truthy(request, param):
   return val is not None and not is_param_falsy(request, param)
 
 
+def get_etag(*parts):
+  """Returns a strong ETag for a response built from the given parts."""
+  return '"' + hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:24] + '"'
+
+
+def is_etag_fresh(request, etag: str):
+  """Determines if the request's If-None-Match header already has the provided etag."""
+  if_none_match = request.headers.get('If-None-Match')
+  if not if_none_match:
+    return False
+  tags = [tag.strip() for tag in if_none_match.split(',')]
+  return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
 def set_default_page_resources(path, routes):
   """ Sets up routes for handling static files under a path."""
 
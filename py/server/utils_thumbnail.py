@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from ..config import get_config_value
+from ..utils import remove_path
+from ..utils_userdata import clean_path
+
+THUMBNAIL_MIN_SIZE = 16
+THUMBNAIL_MAX_SIZE = 2048
+
+# Output format name to (PIL format, extension, content type).
+THUMBNAIL_FORMATS = {
+  'webp': ('WEBP', 'webp', 'image/webp'),
+  'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+  'jpg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+
+# Errors from a bad, unsupported or oversized source image. PIL only raises its decompression bomb
+# warning when warnings are escalated to errors.
+THUMBNAIL_ERRORS = (
+  OSError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning
+)
+
+_THUMBNAIL_DIR = 'thumbnails'
+
+# Encoding is CPU bound, so it gets its own small pool rather than holding up the blocking executor.
+_THUMBNAIL_EXECUTOR = ThreadPoolExecutor(
+  max_workers=get_config_value('server.thumbnail_workers') or 2,
+  thread_name_prefix='draekz_thumbnail'
+)
+
+# Thumbnails being generated, so concurrent requests for the same one share the work.
+_pending = {}
+
+# The size of the thumbnail cache on disk, counted on the first thumbnail created.
+_cache_bytes = None
+_cache_lock = threading.Lock()
+
+
+def _get_thumbnail_path(img_path: str, size: int, output_format: str):
+  """Returns the cache path for a thumbnail, keyed by the source image's path, mtime and size."""
+  stat = os.stat(img_path)
+  key = f'{os.path.abspath(img_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size}'
+  file_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+  return clean_path(f'{_THUMBNAIL_DIR}/{file_hash}.{THUMBNAIL_FORMATS[output_format][1]}')
+
+
+def _create_thumbnail(img_path: str, thumbnail_path: str, size: int, output_format: str):
+  """Resizes an image into a thumbnail at the cache path."""
+  pil_format = THUMBNAIL_FORMATS[output_format][0]
+  with Image.open(img_path) as img:
+    # Lets JPEG sources decode at a reduced scale, which is much faster for large images.
+    img.draft('RGB', (size, size))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((size, size), Image.LANCZOS)
+    keep_alpha = pil_format == 'WEBP' and img.mode in ('RGBA', 'LA', 'P')
+    img = img.convert('RGBA' if keep_alpha else 'RGB')
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    tmp_path = f'{thumbnail_path}.{os.getpid()}.tmp'
+    save_kwargs = {'quality': 85}
+    if pil_format == 'WEBP':
+      save_kwargs['method'] = 4
+    else:
+      save_kwargs['optimize'] = True
+    try:
+      img.save(tmp_path, format=pil_format, **save_kwargs)
+    except BaseException:
+      remove_path(tmp_path)
+      raise
+  os.replace(tmp_path, thumbnail_path)
+
+
+def _get_or_create_thumbnail(img_path: str, size: int, output_format: str):
+  thumbnail_path = _get_thumbnail_path(img_path, size, output_format)
+  if os.path.isfile(thumbnail_path):
+    try:
+      # Marks the thumbnail as recently used, so pruning removes it last.
+      os.utime(thumbnail_path)
+    except OSError:
+      pass
+  else:
+    _create_thumbnail(img_path, thumbnail_path, size, output_format)
+    _prune_thumbnails(os.path.getsize(thumbnail_path))
+  return thumbnail_path
+
+
+def _list_thumbnails():
+  """Returns (mtime, size, path) for each cached thumbnail."""
+  thumbnails = []
+  try:
+    with os.scandir(clean_path(_THUMBNAIL_DIR)) as it:
+      for entry in it:
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+          stat = entry.stat()
+          thumbnails.append((stat.st_mtime, stat.st_size, entry.path))
+  except OSError:
+    pass
+  return thumbnails
+
+
+def _prune_thumbnails(added_bytes: int):
+  """Removes the least recently used thumbnails once the cache exceeds `server.thumbnail_cache_mb`.
+
+  The cache is pruned to 90% of its budget, so it isn't rescanned for every new thumbnail.
+  """
+  global _cache_bytes
+  max_mb = get_config_value('server.thumbnail_cache_mb') or 0
+  if max_mb <= 0:
+    return
+  max_bytes = max_mb * 1024 * 1024
+  with _cache_lock:
+    if _cache_bytes is None:
+      _cache_bytes = sum(size for _, size, _ in _list_thumbnails())
+    else:
+      _cache_bytes += added_bytes
+    if _cache_bytes <= max_bytes:
+      return
+    thumbnails = sorted(_list_thumbnails())
+    _cache_bytes = sum(size for _, size, _ in thumbnails)
+    for _, size, path in thumbnails:
+      if _cache_bytes <= max_bytes * 0.9:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      _cache_bytes -= size
+
+
+async def get_thumbnail(img_path: str, size: int, output_format='webp'):
+  """Returns the path and content type of a cached thumbnail for an image, creating it if needed."""
+  size = max(THUMBNAIL_MIN_SIZE, min(THUMBNAIL_MAX_SIZE, size))
+  output_format = output_format if output_format in THUMBNAIL_FORMATS else 'webp'
+  key = (os.path.abspath(img_path), size, output_format)
+  future = _pending.get(key)
+  if future is None:
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+      _THUMBNAIL_EXECUTOR, _get_or_create_thumbnail, img_path, size, output_format
+    )
+    _pending[key] = future
+    future.add_done_callback(lambda _: _pending.pop(key, None))
+  thumbnail_path = await asyncio.shield(future)
+  return thumbnail_path, THUMBNAIL_FORMATS[output_format][2]
@@ -0,0 +1,783 @@
+import atexit
+import hashlib
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from multiprocessing.connection import Listener
+
+import comfy.model_management
+import folder_paths
+from server import PromptServer
+
+from .config import get_config_value
+from .utils import load_json_file, remove_path, save_json_file
+from .utils_userdata import clean_path
+
+GLOBAL_MODELS_DIR = os.path.join(folder_paths.models_dir, "llm_gguf")
+
+# The userdata directory for cached LLM responses.
+_RESPONSES_DIR = 'llm_responses'
+
+_llm_cache_lock = threading.Lock()
+
+
+class LlmModelCache:
+  """An LRU cache of loaded llama.cpp models, bounded by a RAM budget.
+
+  A model's RAM is estimated from its GGUF file size, plus the capacity of the prompt cache it's
+  given, which can grow to that size alongside it. Loading a model that doesn't fit evicts the
+  least recently used models first, skipping pinned ones; a model larger than the whole budget is
+  still loaded, after evicting everything that isn't pinned.
+
+  Models are used through a `lease`, and a model that's unloaded or evicted while leased is only
+  closed once its last lease is released, so it's never freed under a running generation. Models
+  load outside of the cache's lock, so its status stays available while one loads, and concurrent
+  requests for a model share its load.
+  """
+
+  def __init__(self, max_bytes: int, pinned=None):
+    self.max_bytes = max_bytes
+    self.pinned = set(pinned or [])
+    self.entries = OrderedDict()
+    # Entries removed from the cache while leased, to close when their last lease is released.
+    self.retired = []
+    # Futures for the models being loaded, by model.
+    self.loading = {}
+    self.lock = threading.RLock()
+
+  @contextmanager
+  def lease(self, model: str, load_model, load_params=None):
+    """Yields the cached model, loading it with `load_model()` if needed, for the block's duration.
+
+    A model is only cached once; if it's cached with different `load_params` it's unloaded and
+    loaded again with the new ones.
+    """
+    entry = self._get_entry(model, load_model, load_params or {}, lease=True)
+    try:
+      yield entry['llm']
+    finally:
+      self._release(entry)
+
+  def load(self, model: str, load_model, load_params=None):
+    """Loads a model into the cache, if it isn't already loaded with the same `load_params`."""
+    self._get_entry(model, load_model, load_params or {}, lease=False)
+
+  def _get_entry(self, model: str, load_model, load_params: dict, lease: bool):
+    while True:
+      to_close = []
+      with self.lock:
+        entry = self.entries.get(model)
+        if entry is not None and entry['params'] == load_params:
+          self.entries.move_to_end(model)
+          entry['leases'] += 1 if lease else 0
+          print(f"Draekz LLM: Using cached model '{model}'")
+          return entry
+        future = self.loading.get(model)
+        if future is None:
+          future = Future()
+          self.loading[model] = future
+          if entry is not None:
+            print(f"Draekz LLM: Load options changed for model '{model}', reloading.")
+            to_close += self._remove(model)
+          size = get_model_size(model) + get_prompt_cache_bytes()
+          to_close += self._evict(self.max_bytes - size)
+          break
+      # Another request is loading this model; wait for it and check again. If its load failed,
+      # the next pass loads it here, raising our own error if it fails again.
+      try:
+        future.result()
+      except Exception:  # pylint: disable = broad-exception-caught
+        pass
+
+    try:
+      self._close(to_close)
+      print(f"Draekz LLM: Loading model '{model}'. This may take a moment...")
+      llm = load_model()
+    except BaseException as e:
+      with self.lock:
+        self.loading.pop(model, None)
+      future.set_exception(e)
+      raise
+    entry = {
+      'model': model,
+      'llm': llm,
+      'size': size,
+      'params': dict(load_params),
+      'leases': 1 if lease else 0,
+      'removed': False,
+    }
+    with self.lock:
+      self.entries[model] = entry
+      self.loading.pop(model, None)
+    future.set_result(None)
+    print(f"Draekz LLM: Model '{model}' loaded and cached.")
+    return entry
+
+  def _release(self, entry: dict):
+    with self.lock:
+      entry['leases'] -= 1
+      to_close = [entry] if entry['removed'] and entry['leases'] == 0 else []
+      if to_close:
+        self.retired.remove(entry)
+    self._close(to_close)
+
+  def _remove(self, model: str) -> list:
+    """Removes a model from the cache, returning it to close if it's not leased. Needs the lock."""
+    entry = self.entries.pop(model, None)
+    if entry is None:
+      return []
+    entry['removed'] = True
+    if entry['leases'] > 0:
+      print(f"Draekz LLM: Model '{model}' is in use, unloading it once it's released.")
+      self.retired.append(entry)
+      return []
+    return [entry]
+
+  @staticmethod
+  def _close(entries: list):
+    for entry in entries:
+      print(f"Draekz LLM: Unloading model '{entry['model']}'.")
+      close = getattr(entry['llm'], 'close', None)
+      if callable(close):
+        close()
+
+  def _evict(self, max_bytes: int) -> list:
+    """Removes least recently used, unpinned models until the cache fits within max_bytes.
+
+    Needs the lock, and returns the entries to close once it's released.
+    """
+    to_close = []
+    for model in list(self.entries.keys()):
+      if self.get_total_bytes() <= max_bytes:
+        break
+      if model not in self.pinned:
+        to_close += self._remove(model)
+    return to_close
+
+  def get_total_bytes(self) -> int:
+    """Returns the estimated RAM of all loaded models, including those waiting to be closed."""
+    with self.lock:
+      return sum(entry['size'] for entry in [*self.entries.values(), *self.retired])
+
+  def unload(self, model: str) -> bool:
+    """Unloads a model, whether pinned or not. Returns true if it was loaded."""
+    with self.lock:
+      if model not in self.entries:
+        return False
+      to_close = self._remove(model)
+    self._close(to_close)
+    return True
+
+  def unload_all(self, include_pinned=False) -> list:
+    """Unloads all models, or all unpinned models. Returns the unloaded models."""
+    to_close = []
+    with self.lock:
+      models = [m for m in self.entries if include_pinned or m not in self.pinned]
+      for model in models:
+        to_close += self._remove(model)
+    self._close(to_close)
+    return models
+
+  def set_pinned(self, model: str, pinned: bool):
+    """Pins a model, so it's never evicted to make room for another, or unpins it."""
+    with self.lock:
+      if pinned:
+        self.pinned.add(model)
+      else:
+        self.pinned.discard(model)
+
+  def get_status(self) -> dict:
+    """Returns the loaded, loading and pinned models, and the RAM budget."""
+    with self.lock:
+      return {
+        'loaded': [{
+          'model': model,
+          'size': entry['size'],
+          'params': entry['params'],
+          'pinned': model in self.pinned,
+          'in_use': entry['leases'] > 0,
+        } for model, entry in self.entries.items()],
+        'loading': sorted(self.loading),
+        'unloading': [entry['model'] for entry in self.retired],
+        'pinned': sorted(self.pinned),
+        'total_bytes': self.get_total_bytes(),
+        'max_bytes': self.max_bytes,
+      }
+
+
+_gguf_models = {'mtime': None, 'models': []}
+_gguf_models_lock = threading.Lock()
+
+
+def get_gguf_models() -> list:
+  """Returns the GGUF models in the llm_gguf folder, relisting it only when its mtime changes."""
+  try:
+    mtime = os.stat(GLOBAL_MODELS_DIR).st_mtime_ns
+  except OSError:
+    return []
+  with _gguf_models_lock:
+    if _gguf_models['mtime'] != mtime:
+      _gguf_models['models'] = [
+        file for file in os.listdir(GLOBAL_MODELS_DIR) if file.endswith('.gguf')
+      ]
+      _gguf_models['mtime'] = mtime
+    return list(_gguf_models['models'])
+
+
+def touch_model_file(model: str, chunk_size=1024 * 1024 * 16):
+  """Reads a model file through once, so its pages are in the OS cache for a fast mmap load."""
+  with open(get_model_path(model), 'rb') as file:
+    while file.read(chunk_size):
+      pass
+
+
+def get_model_path(model: str) -> str:
+  """Returns the full path of a model in the llm_gguf folder."""
+  return os.path.join(GLOBAL_MODELS_DIR, model)
+
+
+def get_model_size(model: str) -> int:
+  """Returns the GGUF file size of a model, as an estimate of the RAM it takes once loaded."""
+  try:
+    return os.path.getsize(get_model_path(model))
+  except OSError:
+    return 0
+
+
+def get_prompt_cache_bytes() -> int:
+  """Returns the capacity of each model's prompt cache, from `llm.prompt_cache_mb`."""
+  return max(0, int((get_config_value('llm.prompt_cache_mb') or 0) * 1024 * 1024))
+
+
+def enable_prompt_cache(llm, ram_cache_class):
+  """Gives a model a RAM cache of evaluated prompt states, sized by `llm.prompt_cache_mb`.
+
+  llama.cpp already skips the tokens a prompt shares with the previous one. With the cache, the
+  state after each completion is kept, so a prompt sharing a prefix with any earlier prompt, like
+  the few-shot conversation, restores that state and only evaluates what follows.
+  """
+  capacity_bytes = get_prompt_cache_bytes()
+  if ram_cache_class is None or capacity_bytes <= 0:
+    return
+  llm.set_cache(ram_cache_class(capacity_bytes=capacity_bytes))
+
+
+def prime_prompt_cache(llm, messages: list):
+  """Evaluates a conversation prefix ahead of time, so its state is cached for later requests."""
+  start = time.time()
+  llm.create_chat_completion([*messages, {'role': 'user', 'content': ''}], max_tokens=1)
+  print(f'Draekz LLM: Primed prompt cache in {time.time() - start:.2f}s.')
+
+
+class JsonObjectTracker:
+  """Follows streamed text to tell when a top level JSON object has closed.
+
+  Tracking starts at the first `{`, but only if the text before it is whitespace or the opening of a
+  markdown code fence, so prose that happens to contain a brace isn't cut short. `start` is then the
+  object's offset in all of the text fed.
+  """
+
+  def __init__(self):
+    self.started = False
+    self.depth = 0
+    self.in_string = False
+    self.escaped = False
+    self.prefix = ''
+    self.start = -1
+    self.closed = False
+
+  def feed(self, text: str) -> int:
+    """Feeds more text, returning the index in it just past the object's closing brace, or -1."""
+    for index, char in enumerate(text):
+      if self.closed:
+        return -1
+      if not self.started:
+        if char == '{' and not self.prefix.strip().lstrip('`').removeprefix('json').strip():
+          self.started = True
+          self.start = len(self.prefix)
+          self.depth = 1
+        else:
+          self.prefix += char
+        continue
+      if self.in_string:
+        if self.escaped:
+          self.escaped = False
+        elif char == '\\':
+          self.escaped = True
+        elif char == '"':
+          self.in_string = False
+      elif char == '"':
+        self.in_string = True
+      elif char == '{':
+        self.depth += 1
+      elif char == '}':
+        self.depth -= 1
+        if self.depth == 0:
+          self.closed = True
+          return index + 1
+    return -1
+
+
+def send_progress_text(node_id, text: str):
+  """Shows text on a node while it runs, with ComfyUI's progress text where it's available."""
+  if node_id is None:
+    return
+  server = PromptServer.instance
+  if hasattr(server, 'send_progress_text'):
+    server.send_progress_text(text, node_id)
+  else:
+    server.send_sync('draekz-llm-progress', {'node': node_id, 'text': text})
+
+
+# Minimum seconds between streamed progress updates sent to the UI.
+_PROGRESS_INTERVAL = 0.25
+
+
+class StreamedText:
+  """Collects streamed response text, sending progress to the node and watching for a JSON end."""
+
+  def __init__(self, node_id=None, stop_at_json_end=False):
+    self.node_id = node_id
+    self.tracker = JsonObjectTracker() if stop_at_json_end else None
+    self.text = ''
+    self.last_progress = 0
+
+  def add(self, content: str) -> bool:
+    """Adds streamed content, returning true if the response is complete and should stop.
+
+    When a JSON object closes, the text becomes just that object, without any code fence around it.
+    """
+    end = self.tracker.feed(content) if self.tracker is not None else -1
+    if end != -1:
+      self.text = (self.text + content[:end])[self.tracker.start:]
+      return True
+    self.text += content
+    now = time.monotonic()
+    if now - self.last_progress >= _PROGRESS_INTERVAL:
+      self.last_progress = now
+      send_progress_text(self.node_id, self.text)
+    return False
+
+  def finish(self) -> str:
+    """Sends the final text to the node and returns it."""
+    send_progress_text(self.node_id, self.text)
+    return self.text
+
+
+def stream_chat_completion(llm, messages: list, generate_kwargs: dict, node_id=None,
+                           stop_at_json_end=False, check_interrupt=True) -> str:
+  """Streams a chat completion, returning its text.
+
+  Partial text is sent to the node as it's generated, ComfyUI's interrupt is honoured between
+  tokens, and with `stop_at_json_end` generation stops as soon as a JSON object response closes.
+  """
+  streamed = StreamedText(node_id, stop_at_json_end)
+  stream = llm.create_chat_completion(messages, stream=True, **generate_kwargs)
+  try:
+    for chunk in stream:
+      if check_interrupt:
+        comfy.model_management.throw_exception_if_processing_interrupted()
+      content = chunk['choices'][0]['delta'].get('content')
+      if content and streamed.add(content):
+        break
+  finally:
+    # Closing the generator stops llama.cpp from generating any further tokens.
+    stream.close()
+  return streamed.finish()
+
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils_llm_worker.py')
+# Seconds to wait for a new worker to connect, which includes it importing llama_cpp.
+_WORKER_START_TIMEOUT = 120
+# Idle workers are pinged before use if they haven't been used for this many seconds.
+_WORKER_HEALTH_INTERVAL = 30
+_WORKER_PING_TIMEOUT = 5
+
+
+class LlmWorker:
+  """A worker process running utils_llm_worker.py, and our connection to it."""
+
+  def __init__(self, index: int):
+    self.index = index
+    self.busy = False
+    self.model = None
+    self.load_options = None
+    self.last_used = time.monotonic()
+    authkey = secrets.token_hex(16)
+    listener = Listener(('127.0.0.1', 0), authkey=authkey.encode('utf-8'))
+    try:
+      self.process = subprocess.Popen(
+        [sys.executable, _WORKER_SCRIPT, '--port', str(listener.address[1])],
+        env={**os.environ, 'DRAEKZ_LLM_WORKER_KEY': authkey},
+      )
+      self.conn = self._accept(listener)
+    finally:
+      listener.close()
+    print(f'Draekz LLM: Started worker process {self.index} (pid {self.process.pid}).')
+
+  def _accept(self, listener):
+    """Accepts the worker's connection, giving up if it exits or doesn't connect in time."""
+    result = {}
+
+    def accept():
+      try:
+        result['conn'] = listener.accept()
+      except Exception as e:  # pylint: disable = broad-exception-caught
+        result['error'] = e
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    start = time.monotonic()
+    while thread.is_alive() and time.monotonic() - start < _WORKER_START_TIMEOUT:
+      if self.process.poll() is not None:
+        break
+      thread.join(0.25)
+    if 'conn' not in result:
+      self.process.kill()
+      raise RuntimeError(f'LLM worker process {self.index} failed to start: {result.get("error")}')
+    return result['conn']
+
+  def is_healthy(self) -> bool:
+    """Returns whether the worker process is running and answers a ping."""
+    if self.process.poll() is not None:
+      return False
+    if time.monotonic() - self.last_used < _WORKER_HEALTH_INTERVAL:
+      return True
+    try:
+      self.conn.send({'type': 'ping'})
+      if not self.conn.poll(_WORKER_PING_TIMEOUT):
+        return False
+      message = self.conn.recv()
+      self.model = message.get('model')
+      return message.get('type') == 'pong'
+    except (EOFError, OSError):
+      return False
+
+  def stop(self):
+    """Stops the worker process."""
+    try:
+      self.conn.close()
+    except OSError:
+      pass
+    if self.process.poll() is None:
+      self.process.terminate()
+      try:
+        self.process.wait(5)
+      except subprocess.TimeoutExpired:
+        self.process.kill()
+
+
+class LlmWorkerPool:
+  """Runs LLM generations in worker processes, so they don't hold up ComfyUI's execution thread.
+
+  Requests wait for an idle worker, preferring one that already has the model loaded with the same
+  load options, then one without a model, then the least recently used. Workers that exited or
+  stopped answering pings are replaced when they're next picked.
+  """
+
+  def __init__(self, size: int):
+    self.size = size
+    self.workers = []
+    # Slots reserved for workers being started, outside of the condition.
+    self.starting = 0
+    self.condition = threading.Condition()
+    atexit.register(self.stop)
+
+  def _pick_worker(self, model: str, load_options: dict):
+    idle = [worker for worker in self.workers if not worker.busy]
+    for worker in idle:
+      if worker.model == model and worker.load_options == load_options:
+        return worker
+    for worker in idle:
+      if worker.model is None:
+        return worker
+    if len(self.workers) + self.starting < self.size:
+      return None
+    return min(idle, key=lambda w: w.last_used) if idle else False
+
+  def _acquire(self, model: str, load_options: dict) -> LlmWorker:
+    with self.condition:
+      while True:
+        worker = self._pick_worker(model, load_options)
+        if worker is not False:
+          break
+        self.condition.wait()
+      # Reserve a new worker's slot, or the picked worker, so starting or checking it doesn't hold
+      # up the other requests.
+      if worker is None:
+        self.starting += 1
+        index = len(self.workers) + self.starting - 1
+      else:
+        worker.busy = True
+        index = worker.index
+    if worker is not None and worker.is_healthy():
+      return worker
+    try:
+      if worker is not None:
+        print(f'Draekz LLM: Worker process {worker.index} is unresponsive, restarting it.')
+        worker.stop()
+      new_worker = LlmWorker(index)
+    except BaseException:
+      with self.condition:
+        if worker is None:
+          self.starting -= 1
+        elif worker in self.workers:
+          self.workers.remove(worker)
+        self.condition.notify()
+      raise
+    with self.condition:
+      new_worker.busy = True
+      if worker is None:
+        self.starting -= 1
+        self.workers.append(new_worker)
+      elif worker in self.workers:
+        self.workers[self.workers.index(worker)] = new_worker
+      else:
+        self.workers.append(new_worker)
+    return new_worker
+
+  def _release(self, worker: LlmWorker):
+    with self.condition:
+      worker.busy = False
+      worker.last_used = time.monotonic()
+      self.condition.notify()
+
+  def generate(self, request: dict, node_id=None, stop_at_json_end=False, check_interrupt=True):
+    """Generates a chat completion in a worker, streaming it like `stream_chat_completion`.
+
+    `request` holds the worker's generate fields (see utils_llm_worker.py) other than its id.
+    """
+    worker = self._acquire(request['model'], request['load_options'])
+    request_id = uuid.uuid4().hex
+    streamed = StreamedText(node_id, stop_at_json_end)
+    stopping = False
+    try:
+      worker.conn.send({**request, 'type': 'generate', 'id': request_id})
+      while True:
+        if check_interrupt and not stopping:
+          try:
+            comfy.model_management.throw_exception_if_processing_interrupted()
+          except BaseException:
+            worker.conn.send({'type': 'cancel', 'id': request_id})
+            self._drain(worker, request_id)
+            raise
+        if not worker.conn.poll(0.1):
+          if worker.process.poll() is not None:
+            raise RuntimeError(f'LLM worker process {worker.index} exited.')
+          continue
+        message = worker.conn.recv()
+        if message.get('id') != request_id:
+          continue
+        if message['type'] == 'chunk' and not stopping:
+          if streamed.add(message['content']):
+            stopping = True
+            worker.conn.send({'type': 'cancel', 'id': request_id})
+        elif message['type'] == 'done':
+          break
+        elif message['type'] == 'error':
+          raise RuntimeError(f'LLM worker error: {message.get("error")}')
+      worker.model = request['model']
+      worker.load_options = request['load_options']
+    except (EOFError, OSError) as e:
+      worker.stop()
+      raise RuntimeError(f'Lost connection to LLM worker process {worker.index}.') from e
+    finally:
+      self._release(worker)
+    return streamed.finish()
+
+  def _drain(self, worker: LlmWorker, request_id: str):
+    """Reads a cancelled request's remaining messages, stopping the worker if it doesn't finish."""
+    start = time.monotonic()
+    while time.monotonic() - start < _WORKER_PING_TIMEOUT:
+      if worker.conn.poll(0.1):
+        message = worker.conn.recv()
+        if message.get('id') == request_id and message['type'] in ('done', 'error'):
+          return
+    worker.stop()
+
+  def unload_all(self) -> list:
+    """Stops all idle workers, freeing their models. Returns the models that were loaded."""
+    with self.condition:
+      idle = [worker for worker in self.workers if not worker.busy]
+      for worker in idle:
+        worker.stop()
+        self.workers.remove(worker)
+      for index, worker in enumerate(self.workers):
+        worker.index = index
+      return [worker.model for worker in idle if worker.model]
+
+  def get_status(self) -> list:
+    """Returns each worker's process id, model, and whether it's busy."""
+    with self.condition:
+      return [{
+        'index': worker.index,
+        'pid': worker.process.pid,
+        'model': worker.model,
+        'busy': worker.busy,
+      } for worker in self.workers]
+
+  def stop(self):
+    """Stops all workers."""
+    with self.condition:
+      for worker in self.workers:
+        worker.stop()
+      self.workers = []
+
+
+_worker_pool = None
+
+
+def get_worker_pool():
+  """Returns the LLM worker pool, or None to generate in process (`llm.worker_processes` of 0)."""
+  global _worker_pool
+  with _llm_cache_lock:
+    if _worker_pool is None:
+      size = get_config_value('llm.worker_processes') or 0
+      if size <= 0:
+        return None
+      _worker_pool = LlmWorkerPool(size)
+    return _worker_pool
+
+
+_llm_cache = None
+
+
+def get_llm_cache() -> LlmModelCache:
+  """Returns the shared LLM model cache."""
+  global _llm_cache
+  with _llm_cache_lock:
+    if _llm_cache is None:
+      max_mb = get_config_value('llm.cache_mb') or 0
+      _llm_cache = LlmModelCache(
+        int(max_mb * 1024 * 1024), pinned=get_config_value('llm.pinned_models') or []
+      )
+    return _llm_cache
+
+
+class LlmResponseCache:
+  """A cache of LLM responses keyed by a hash of the full request.
+
+  Responses are held in memory, LRU up to `max_entries`, and optionally also written to
+  userdata/llm_responses, where the oldest are removed past `max_disk_entries`, so they survive
+  restarts.
+  """
+
+  def __init__(self, max_entries: int, use_disk=False, max_disk_entries=0):
+    self.max_entries = max_entries
+    self.use_disk = use_disk and max_disk_entries > 0
+    self.max_disk_entries = max_disk_entries
+    self.entries = OrderedDict()
+    # The response keys on disk, oldest first, read from the directory on the first write.
+    self.disk_keys = None
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def get_key(model: str, request: dict) -> str:
+    """Returns the cache key for a request to a model.
+
+    The model file's size and mtime are part of the key, so replacing a model invalidates its
+    responses.
+    """
+    try:
+      stat = os.stat(get_model_path(model))
+      model_id = [model, stat.st_size, stat.st_mtime_ns]
+    except OSError:
+      model_id = [model]
+    data = json.dumps([model_id, request], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+  @staticmethod
+  def _get_disk_path(key: str) -> str:
+    return clean_path(f'{_RESPONSES_DIR}/{key}.json')
+
+  def get(self, key: str):
+    """Returns the cached response for a key, or None."""
+    with self.lock:
+      if key in self.entries:
+        self.entries.move_to_end(key)
+        return self.entries[key]
+    if self.use_disk:
+      data = load_json_file(self._get_disk_path(key), default=None)
+      if data is not None and 'response' in data:
+        self._put_memory(key, data['response'])
+        return data['response']
+    return None
+
+  def put(self, key: str, response: str, model=None):
+    """Caches a response for a key."""
+    self._put_memory(key, response)
+    if self.use_disk:
+      save_json_file(
+        self._get_disk_path(key), {'model': model, 'timestamp': time.time(), 'response': response}
+      )
+      self._add_disk_key(key)
+
+  def _put_memory(self, key: str, response: str):
+    if self.max_entries <= 0:
+      return
+    with self.lock:
+      self.entries[key] = response
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def _add_disk_key(self, key: str):
+    """Records a response written to disk, removing the oldest ones past the max."""
+    with self.lock:
+      if self.disk_keys is None:
+        self.disk_keys = self._read_disk_keys()
+      self.disk_keys[key] = True
+      self.disk_keys.move_to_end(key)
+      removed = []
+      while len(self.disk_keys) > self.max_disk_entries:
+        removed.append(self.disk_keys.popitem(last=False)[0])
+    for removed_key in removed:
+      remove_path(self._get_disk_path(removed_key))
+
+  @staticmethod
+  def _read_disk_keys() -> OrderedDict:
+    """Returns the keys of the responses on disk, ordered oldest first."""
+    try:
+      with os.scandir(clean_path(_RESPONSES_DIR)) as it:
+        files = [(entry.stat().st_mtime, entry.name[:-len('.json')])
+                 for entry in it if entry.name.endswith('.json')]
+    except OSError:
+      files = []
+    return OrderedDict((key, True) for _, key in sorted(files))
+
+  def clear(self):
+    """Removes all responses, from memory and disk."""
+    with self.lock:
+      self.entries.clear()
+      self.disk_keys = None
+    if self.use_disk:
+      cache_dir = clean_path(_RESPONSES_DIR)
+      if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+          if name.endswith('.json'):
+            remove_path(os.path.join(cache_dir, name))
+
+
+_response_cache = None
+
+
+def get_response_cache() -> LlmResponseCache:
+  """Returns the shared LLM response cache."""
+  global _response_cache
+  with _llm_cache_lock:
+    if _response_cache is None:
+      _response_cache = LlmResponseCache(
+        get_config_value('llm.response_cache_entries') or 0,
+        use_disk=get_config_value('llm.response_cache_disk') is True,
+        max_disk_entries=get_config_value('llm.response_cache_disk_entries') or 0,
+      )
+    return _response_cache
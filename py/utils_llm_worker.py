@@ -0,0 +1,133 @@
+"""A standalone llama.cpp worker process, run by the LLM worker pool in utils_llm.
+
+This is started as a script, not imported, so it only depends on llama_cpp. It connects back to
+the pool at the address given on the command line, authenticating with the key in the
+DRAEKZ_LLM_WORKER_KEY environment variable, and then answers one request at a time:
+
+  {'type': 'ping'} -> {'type': 'pong', 'model': loaded model or None}
+  {'type': 'generate', 'id', 'model', 'model_path', 'load_options', 'prompt_cache_bytes',
+   'prime_messages', 'messages', 'generate_kwargs', 'grammar'}
+      -> {'type': 'chunk', 'id', 'content'}... then {'type': 'done', 'id'} or {'type': 'error', ...}
+  {'type': 'cancel', 'id'} stops the generation with that id between tokens.
+
+A worker holds a single model; the pool routes requests for a model to the worker holding it, and
+stops idle workers to free their models.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import traceback
+
+from multiprocessing.connection import Client
+
+try:
+  llama_cpp = importlib.import_module("llama_cpp_cuda")
+except ImportError:
+  llama_cpp = importlib.import_module("llama_cpp")
+
+
+class Worker:
+  """Holds the worker's model and handles requests from the pool."""
+
+  def __init__(self, conn):
+    self.conn = conn
+    self.model = None
+    self.load_options = None
+    self.llm = None
+    self.grammars = {}
+
+  def get_llm(self, request: dict):
+    """Returns the requested model, loading it (and unloading the current one) if needed."""
+    if self.model == request['model'] and self.load_options == request['load_options']:
+      return self.llm
+    self.unload()
+    llm = llama_cpp.Llama(model_path=request['model_path'], verbose=False,
+                          **request['load_options'])
+    if request.get('prompt_cache_bytes') and hasattr(llama_cpp, 'LlamaRAMCache'):
+      llm.set_cache(llama_cpp.LlamaRAMCache(capacity_bytes=request['prompt_cache_bytes']))
+    if request.get('prime_messages'):
+      llm.create_chat_completion(
+        [*request['prime_messages'], {'role': 'user', 'content': ''}], max_tokens=1
+      )
+    self.model = request['model']
+    self.load_options = request['load_options']
+    self.llm = llm
+    return llm
+
+  def unload(self):
+    """Unloads the current model."""
+    if self.llm is not None:
+      close = getattr(self.llm, 'close', None)
+      if callable(close):
+        close()
+    self.model = None
+    self.load_options = None
+    self.llm = None
+
+  def get_grammar(self, grammar: str):
+    if grammar not in self.grammars:
+      self.grammars[grammar] = llama_cpp.LlamaGrammar.from_string(grammar, verbose=False)
+    return self.grammars[grammar]
+
+  def is_cancelled(self, request_id) -> bool:
+    """Checks, without blocking, whether the pool cancelled the request."""
+    while self.conn.poll():
+      message = self.conn.recv()
+      if message.get('type') == 'cancel' and message.get('id') == request_id:
+        return True
+    return False
+
+  def generate(self, request: dict):
+    """Streams a chat completion back to the pool."""
+    llm = self.get_llm(request)
+    generate_kwargs = dict(request['generate_kwargs'])
+    if request.get('grammar'):
+      generate_kwargs['grammar'] = self.get_grammar(request['grammar'])
+    stream = llm.create_chat_completion(request['messages'], stream=True, **generate_kwargs)
+    try:
+      for chunk in stream:
+        if self.is_cancelled(request['id']):
+          break
+        content = chunk['choices'][0]['delta'].get('content')
+        if content:
+          self.conn.send({'type': 'chunk', 'id': request['id'], 'content': content})
+    finally:
+      stream.close()
+
+  def run(self):
+    """Handles requests until the pool disconnects."""
+    while True:
+      try:
+        request = self.conn.recv()
+      except (EOFError, OSError):
+        return
+      request_type = request.get('type')
+      try:
+        if request_type == 'ping':
+          self.conn.send({'type': 'pong', 'model': self.model})
+        elif request_type == 'generate':
+          self.generate(request)
+          self.conn.send({'type': 'done', 'id': request['id']})
+      except Exception as e:  # pylint: disable = broad-exception-caught
+        traceback.print_exc()
+        self.conn.send({'type': 'error', 'id': request.get('id'), 'error': str(e)})
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, required=True)
+  args = parser.parse_args()
+  authkey = os.environ.get('DRAEKZ_LLM_WORKER_KEY', '').encode('utf-8')
+  conn = Client((args.host, args.port), authkey=authkey)
+  try:
+    Worker(conn).run()
+  finally:
+    conn.close()
+  sys.exit(0)
+
+
+if __name__ == '__main__':
+  main()
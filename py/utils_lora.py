@@ -0,0 +1,281 @@
+import os
+import threading
+import weakref
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import comfy.sd
+import comfy.utils
+import folder_paths
+
+from .config import get_config_value
+from .log import log
+
+
+class PatchedModelCache:
+  """An LRU cache of models and clips with a stack of loras applied.
+
+  Entries are keyed by the identity of the upstream model and clip, plus the ordered stack of
+  (lora, strength_model, strength_clip) applied to them, and every prefix of a stack is cached on
+  the way. So, changing only the last lora of a stack reapplies just that one lora, starting from
+  the cached result of the loras before it.
+
+  Patched clones share their upstream model's weights, so an entry for an upstream model ComfyUI
+  has since dropped (like after switching checkpoints) would keep that whole model in memory. So,
+  only entries for the current upstream model and clip are kept; the others are evicted as soon as
+  a stack is applied to a different upstream. Entries hold their upstream only weakly, which also
+  keeps its id from being reused while the entry exists. What an entry then keeps alive beyond
+  ComfyUI's own references is its lora patches, estimated from the lora file sizes; entries are
+  evicted, least recently used first, once that exceeds `max_bytes` or there are more than
+  `max_entries`.
+  """
+
+  def __init__(self, max_bytes: int, max_entries: int):
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.total_bytes = 0
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def _get_key(model, clip, stack):
+    return (id(model), id(clip), tuple(stack))
+
+  @staticmethod
+  def _ref(obj):
+    """Returns a callable giving back the object, holding it weakly where it can be."""
+    if obj is None:
+      return lambda: None
+    try:
+      return weakref.ref(obj)
+    except TypeError:
+      return lambda: obj
+
+  @staticmethod
+  def _is_upstream(entry, model, clip) -> bool:
+    return entry['upstream'][0]() is model and entry['upstream'][1]() is clip
+
+  def retain_upstream(self, model, clip):
+    """Evicts the entries for any upstream model and clip other than these."""
+    with self.lock:
+      for key, entry in list(self.entries.items()):
+        if not self._is_upstream(entry, model, clip):
+          del self.entries[key]
+          self.total_bytes -= entry['size']
+
+  def get_longest_prefix(self, model, clip, stack):
+    """Returns the length of the longest cached prefix of the stack, and its model and clip."""
+    with self.lock:
+      for length in range(len(stack), 0, -1):
+        key = self._get_key(model, clip, stack[:length])
+        entry = self.entries.get(key)
+        if entry is not None and self._is_upstream(entry, model, clip):
+          self.entries.move_to_end(key)
+          return length, entry['model'], entry['clip']
+    return 0, model, clip
+
+  def put(self, model, clip, stack, patched_model, patched_clip, size: int):
+    """Caches the patched model and clip for a stack applied to the upstream model and clip."""
+    if size > self.max_bytes:
+      return
+    with self.lock:
+      key = self._get_key(model, clip, stack)
+      old_entry = self.entries.pop(key, None)
+      if old_entry is not None:
+        self.total_bytes -= old_entry['size']
+      self.entries[key] = {
+        'upstream': (self._ref(model), self._ref(clip)),
+        'model': patched_model,
+        'clip': patched_clip,
+        'size': size,
+      }
+      self.total_bytes += size
+      while self.entries and (self.total_bytes > self.max_bytes
+                              or len(self.entries) > self.max_entries):
+        _, entry = self.entries.popitem(last=False)
+        self.total_bytes -= entry['size']
+
+  def clear(self):
+    """Removes all entries."""
+    with self.lock:
+      self.entries.clear()
+      self.total_bytes = 0
+
+
+def get_lora_file_size(lora: str) -> int:
+  """Returns the size of a lora file, as an estimate of the memory its tensors take."""
+  lora_path = folder_paths.get_full_path('loras', lora)
+  try:
+    return os.path.getsize(lora_path) if lora_path else 0
+  except OSError:
+    return 0
+
+
+_patched_model_cache = None
+
+
+def get_patched_model_cache():
+  """Returns the shared patched model cache, or None if it's disabled in the config."""
+  global _patched_model_cache
+  if _patched_model_cache is None:
+    max_mb = get_config_value('lora_loader.patched_cache_mb') or 0
+    max_entries = get_config_value('lora_loader.patched_cache_entries') or 0
+    if max_mb <= 0 or max_entries <= 0:
+      return None
+    _patched_model_cache = PatchedModelCache(int(max_mb * 1024 * 1024), max_entries)
+  return _patched_model_cache
+
+
+def apply_lora_stack(model, clip, stack, apply_lora):
+  """Applies a stack of (lora, strength_model, strength_clip) to the model and clip.
+
+  `apply_lora(model, clip, lora, strength_model, strength_clip)` returns the patched model and clip.
+  Results are taken from, and added to, the patched model cache so only loras past the longest
+  cached prefix of the stack are applied.
+  """
+  stack = list(stack)
+  cache = get_patched_model_cache()
+  if cache is None:
+    for lora, strength_model, strength_clip in stack:
+      model, clip = apply_lora(model, clip, lora, strength_model, strength_clip)
+    return model, clip
+
+  cache.retain_upstream(model, clip)
+  start, patched_model, patched_clip = cache.get_longest_prefix(model, clip, stack)
+  for index in range(start, len(stack)):
+    lora, strength_model, strength_clip = stack[index]
+    patched_model, patched_clip = apply_lora(
+      patched_model, patched_clip, lora, strength_model, strength_clip
+    )
+    # Loras before this one are shared with the previous prefix's entry, so each entry only counts
+    # the lora it added.
+    cache.put(
+      model, clip, stack[:index + 1], patched_model, patched_clip, get_lora_file_size(lora)
+    )
+  return patched_model, patched_clip
+
+
+class LoraStateDictCache:
+  """An LRU cache of loaded lora state dicts, held in CPU RAM up to `max_bytes`.
+
+  Loads of the same lora share one read, whether they come from a node or a prefetch, by waiting
+  on the load already in flight.
+  """
+
+  def __init__(self, max_bytes: int):
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.total_bytes = 0
+    self.pending = {}
+    self.lock = threading.Lock()
+
+  def get(self, lora_path: str):
+    """Returns the state dict for a lora file, loading it if it's not cached."""
+    with self.lock:
+      entry = self.entries.get(lora_path)
+      if entry is not None:
+        self.entries.move_to_end(lora_path)
+        return entry['state_dict']
+      future = self.pending.get(lora_path)
+      owner = future is None
+      if owner:
+        future = Future()
+        self.pending[lora_path] = future
+    if not owner:
+      return future.result()
+
+    try:
+      state_dict = comfy.utils.load_torch_file(lora_path, safe_load=True)
+      self._put(lora_path, state_dict)
+      future.set_result(state_dict)
+      return state_dict
+    except BaseException as e:
+      future.set_exception(e)
+      raise
+    finally:
+      with self.lock:
+        self.pending.pop(lora_path, None)
+
+  def contains(self, lora_path: str) -> bool:
+    """Returns whether a lora file is cached or being loaded."""
+    with self.lock:
+      return lora_path in self.entries or lora_path in self.pending
+
+  def _put(self, lora_path: str, state_dict: dict):
+    size = sum(getattr(tensor, 'nbytes', 0) for tensor in state_dict.values())
+    if size > self.max_bytes:
+      return
+    with self.lock:
+      self.entries[lora_path] = {'state_dict': state_dict, 'size': size}
+      self.total_bytes += size
+      while self.entries and self.total_bytes > self.max_bytes:
+        _, entry = self.entries.popitem(last=False)
+        self.total_bytes -= entry['size']
+
+  def clear(self):
+    """Removes all entries."""
+    with self.lock:
+      self.entries.clear()
+      self.total_bytes = 0
+
+
+_state_dict_cache = None
+
+# Prefetches run one at a time; they're disk bound and shouldn't compete with a running prompt.
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='draekz_lora_prefetch')
+
+
+def get_state_dict_cache():
+  """Returns the shared lora state dict cache, or None if it's disabled in the config."""
+  global _state_dict_cache
+  if _state_dict_cache is None:
+    max_mb = get_config_value('lora_loader.state_dict_cache_mb') or 0
+    if max_mb <= 0:
+      return None
+    _state_dict_cache = LoraStateDictCache(int(max_mb * 1024 * 1024))
+  return _state_dict_cache
+
+
+def load_lora_state_dict(lora: str):
+  """Returns the state dict for a lora, from the cache when enabled."""
+  lora_path = folder_paths.get_full_path_or_raise('loras', lora)
+  cache = get_state_dict_cache()
+  if cache is None:
+    return comfy.utils.load_torch_file(lora_path, safe_load=True)
+  return cache.get(lora_path)
+
+
+def apply_lora(model, clip, lora: str, strength_model: float, strength_clip: float):
+  """Applies a lora to the model and clip, like LoraLoader.load_lora, but with a cached state dict."""
+  if strength_model == 0 and strength_clip == 0:
+    return model, clip
+  state_dict = load_lora_state_dict(lora)
+  return comfy.sd.load_lora_for_models(model, clip, state_dict, strength_model, strength_clip)
+
+
+def _prefetch_lora(lora_path: str):
+  try:
+    _state_dict_cache.get(lora_path)
+  except Exception as e:  # pylint: disable = broad-exception-caught
+    log(f'Could not prefetch lora {lora_path}: {e}', color='YELLOW', msg_color='YELLOW')
+
+
+def submit_prefetch(func, *args):
+  """Runs a function on the prefetch thread, like resolving the loras to prefetch."""
+  return _PREFETCH_EXECUTOR.submit(func, *args)
+
+
+def prefetch_loras(loras) -> list:
+  """Loads loras into the state dict cache in the background, returning those queued."""
+  cache = get_state_dict_cache()
+  if cache is None:
+    return []
+  queued = []
+  for lora in loras:
+    lora_path = folder_paths.get_full_path('loras', lora)
+    if lora_path is None or lora_path in queued or cache.contains(lora_path):
+      continue
+    queued.append(lora_path)
+    _PREFETCH_EXECUTOR.submit(_prefetch_lora, lora_path)
+  return queued
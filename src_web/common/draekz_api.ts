@@ -80,7 +80,7 @@ class DraekzApi {
 
   getLoras(force = false) {
     if (!this.getLorasPromise || force) {
-      this.getLorasPromise = this.fetchJson("/loras?format=details", {cache: "no-store"});
+      this.getLorasPromise = this.fetchJson("/loras?format=details", {cache: "no-cache"});
     }
     return this.getLorasPromise;
   }
@@ -0,0 +1,126 @@
+"""Benchmarks merging trainedWords in the model info pipeline.
+
+Times `_merge_civitai_data` and `_update_data` on a model with many `ss_tag_frequency` words and
+civitai trigger words, against the linear scans they replaced, and checks both give the same words.
+
+This imports ComfyUI's `server` and `folder_paths`, so run it with ComfyUI's directory on the path,
+from this repo's directory: `PYTHONPATH=/path/to/ComfyUI python tests/bench_trained_words.py`
+"""
+
+import argparse
+import copy
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from py.server import utils_info  # pylint: disable = wrong-import-position
+from py.utils import get_dict_value  # pylint: disable = wrong-import-position
+
+
+def merge_civitai_words_linear(info_data: dict, data_civitai: dict):
+  """The civitai word merge of `_merge_civitai_data` before the word index, for comparison."""
+  civitai_trigger = get_dict_value(data_civitai, 'triggerWords', default=[])
+  civitai_trained = get_dict_value(data_civitai, 'trainedWords', default=[])
+  civitai_words = ','.join(civitai_trigger + civitai_trained)
+  if civitai_words:
+    civitai_words = re.sub(r"\s*,\s*", ",", civitai_words)
+    civitai_words = re.sub(r",+", ",", civitai_words)
+    civitai_words = re.sub(r"^,", "", civitai_words)
+    civitai_words = re.sub(r",$", "", civitai_words)
+    if civitai_words:
+      civitai_words = civitai_words.split(',')
+      if 'trainedWords' not in info_data:
+        info_data['trainedWords'] = []
+      for trigger_word in civitai_words:
+        word_data = next(
+          (data for data in info_data['trainedWords'] if data['word'] == trigger_word), None
+        )
+        if word_data is None:
+          word_data = {'word': trigger_word}
+          info_data['trainedWords'].append(word_data)
+        word_data['civitai'] = True
+
+
+def update_data_linear(info_data: dict):
+  """The trigger word port of `_update_data` before the word index, for comparison."""
+  civitai_words = ','.join((
+    get_dict_value(info_data, 'raw.civitai.triggerWords', default=[]) +
+    get_dict_value(info_data, 'raw.civitai.trainedWords', default=[])
+  ))
+  if 'trainedWords' not in info_data:
+    info_data['trainedWords'] = []
+  for trigger_word in info_data['triggerWords']:
+    word_data = next((data for data in info_data['trainedWords'] if data['word'] == trigger_word),
+                     None)
+    if word_data is None:
+      word_data = {'word': trigger_word}
+      info_data['trainedWords'].append(word_data)
+    if trigger_word in civitai_words:
+      word_data['civitai'] = True
+    else:
+      word_data['user'] = True
+  del info_data['triggerWords']
+
+
+def get_info_data(num_words: int) -> dict:
+  """Returns model info with `num_words` trained words from kohya metadata."""
+  random.seed(0)
+  tags = {f'tag_{i}': random.randint(1, 500) for i in range(num_words)}
+  info_data = {'raw': {}, 'images': []}
+  utils_info._merge_metadata(info_data, {'ss_tag_frequency': {'bucket': tags}})
+  return info_data
+
+
+def time_ms(fn, *args) -> float:
+  start = time.perf_counter()
+  fn(*args)
+  return (time.perf_counter() - start) * 1000
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--words', type=int, default=5000)
+  args = parser.parse_args()
+  num_words = args.words
+
+  # Half of the civitai words are already in the metadata words, half are new.
+  trigger_words = [f'tag_{i}' for i in range(0, num_words * 2, 2)]
+  data_civitai = {
+    'model': {'name': 'model'},
+    'name': 'version',
+    'triggerWords': trigger_words,
+    'trainedWords': ['a, b ,c', 'tag_1'],
+    '_sha256': 'sha256',
+    'images': [],
+  }
+
+  indexed = get_info_data(num_words)
+  indexed_ms = time_ms(utils_info._merge_civitai_data, indexed, copy.deepcopy(data_civitai))
+  linear = get_info_data(num_words)
+  linear_ms = time_ms(merge_civitai_words_linear, linear, copy.deepcopy(data_civitai))
+  assert indexed['trainedWords'] == linear['trainedWords'], 'Merged civitai words differ'
+  print(f'_merge_civitai_data ({num_words} words): {linear_ms:.1f}ms linear, '
+        f'{indexed_ms:.1f}ms indexed')
+
+  def get_legacy_info_data():
+    return {
+      'trainedWords': get_info_data(num_words)['trainedWords'],
+      'triggerWords': trigger_words,
+      'raw': {'civitai': {'trainedWords': ['tag_10,tag_12']}},
+    }
+
+  indexed = get_legacy_info_data()
+  indexed_ms = time_ms(utils_info._update_data, indexed)
+  linear = get_legacy_info_data()
+  linear_ms = time_ms(update_data_linear, linear)
+  # The linear port checked civitai words as substrings of a joined string, so only compare words.
+  assert [w['word'] for w in indexed['trainedWords']] == [w['word'] for w in linear['trainedWords']]
+  print(f'_update_data ({num_words} words): {linear_ms:.1f}ms linear, {indexed_ms:.1f}ms indexed')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+"""Tests for the in-memory model catalog.
+
+These import ComfyUI's `folder_paths`, so run them with ComfyUI's directory on the path, from this
+repo's directory: `PYTHONPATH=/path/to/ComfyUI python -m unittest discover tests`
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import folder_paths  # pylint: disable = wrong-import-position
+
+from py.server.utils_model_catalog import ModelCatalog  # pylint: disable = wrong-import-position
+
+
+class ModelCatalogTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.loras_dir = self.temp_dir.name
+    patches = [
+      mock.patch.object(folder_paths, 'get_folder_paths', lambda _: [self.loras_dir]),
+      mock.patch.dict(
+        folder_paths.folder_names_and_paths, {'loras': ([self.loras_dir], {'.safetensors'})}
+      ),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+    self.addCleanup(self.temp_dir.cleanup)
+
+  def _write(self, name: str):
+    with open(os.path.join(self.loras_dir, name), 'wb') as file:
+      file.write(b'0')
+
+  def test_finds_preview_image_and_info_file(self):
+    self._write('foo.safetensors')
+    self._write('foo.png')
+    self._write('foo.safetensors.draekz-info.json')
+    self._write('bar.safetensors')
+
+    catalog = ModelCatalog('loras')
+    foo = catalog.get_file_info('foo.safetensors')
+    bar = catalog.get_file_info('bar.safetensors')
+
+    self.assertTrue(foo['imageLocal'].startswith('/draekz/api/loras/img?file=foo.safetensors&v='))
+    self.assertEqual(foo['imagePath'], os.path.join(self.loras_dir, 'foo.png'))
+    self.assertTrue(foo['hasInfoFile'])
+    self.assertIsNone(bar['imageLocal'])
+    self.assertFalse(bar['hasInfoFile'])
+
+  def test_matches_preview_image_and_info_file_ignoring_case(self):
+    self._write('foo.safetensors')
+    self._write('foo.PNG')
+    self._write('foo.safetensors.Draekz-Info.JSON')
+    self._write('Bar.safetensors')
+    self._write('bar.JPG')
+
+    catalog = ModelCatalog('loras')
+    foo = catalog.get_file_info('foo.safetensors')
+    bar = catalog.get_file_info('Bar.safetensors')
+
+    self.assertEqual(foo['imagePath'], os.path.join(self.loras_dir, 'foo.PNG'))
+    self.assertTrue(foo['hasInfoFile'])
+    self.assertEqual(bar['imagePath'], os.path.join(self.loras_dir, 'bar.JPG'))
+
+  def test_refresh_picks_up_new_preview_image(self):
+    self._write('foo.safetensors')
+    catalog = ModelCatalog('loras', min_refresh_interval=0)
+    version = catalog.get_version()
+    self.assertIsNone(catalog.get_file_info('foo.safetensors')['imageLocal'])
+
+    self._write('foo.WEBP')
+    # Directory mtimes can be coarse, so forget them rather than relying on them to change.
+    catalog.dir_mtimes.clear()
+
+    self.assertIsNotNone(catalog.get_file_info('foo.safetensors')['imageLocal'])
+    self.assertEqual(catalog.changed_since(version)[1], ['foo.safetensors'])
+
+
+if __name__ == '__main__':
+  unittest.main()